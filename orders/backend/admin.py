@@ -1,5 +1,3 @@
-import requests as rqs
-import yaml
 from backend.models import (
     STATE_CHOICES,
     Address,
@@ -13,9 +11,11 @@ from backend.models import (
     Shop,
     User,
 )
-from backend.tasks import do_import_task, send_email_task
+from backend.tasks import send_email_task, update_price_lists_task
+from celery.result import AsyncResult
 from django.contrib import admin
 from django.contrib.admin import helpers
+from django.shortcuts import redirect
 from django.template.response import TemplateResponse
 from django.urls import path
 
@@ -153,8 +153,17 @@ class ShopAdmin(admin.ModelAdmin):
         ("url", "file"),
         "update_dt",
         "is_uptodate",
+        ("source_etag", "source_last_modified"),
+        "source_sha256",
+    )
+    readonly_fields = (
+        "id",
+        "url",
+        "file",
+        "source_etag",
+        "source_last_modified",
+        "source_sha256",
     )
-    readonly_fields = ("id", "url", "file")
     list_display = ("name", "user", "state", "is_uptodate")
     inlines = [
         DeliveryInline,
@@ -166,53 +175,51 @@ class ShopAdmin(admin.ModelAdmin):
     def get_urls(self):
         urls = super().get_urls()
         my_urls = [
-            path("update/", self.make_uptodate_view),
+            path(
+                "update/",
+                self.admin_site.admin_view(self.make_uptodate_view),
+                name="backend_shop_update",
+            ),
+            path(
+                "update/<str:task_id>/",
+                self.admin_site.admin_view(self.update_result_view),
+                name="backend_shop_update_result",
+            ),
         ]
         return my_urls + urls
 
-    def make_uptodate_view(self, request):
-        context = dict(
+    def get_result_context(self, request):
+        return dict(
             # Include common variables for rendering the admin template.
             self.admin_site.each_context(request),
             opts=self.model._meta,
             action_checkbox_name=helpers.ACTION_CHECKBOX_NAME,
             title="Результат операции",
         )
-        ids = request.GET.get("ids")
-        updating, not_updated, already_updated = [], dict(), []
-
-        for shop_id in ids.split(","):
-            shop = Shop.objects.get(id=shop_id)
-
-            if shop.is_uptodate:
-                already_updated.append(shop.name)
-                continue
-
-            if shop.file:
-                stream = shop.file
-            elif shop.url:
-                try:
-                    result = rqs.get(shop.url)
-                except rqs.exceptions.ConnectionError:
-                    not_updated[shop.name] = "Нет соединения"
-                    continue
-                else:
-                    if result.ok:
-                        stream = result.content
-                    else:
-                        not_updated[shop.name] = "Файл не найден"
-                        continue
-            else:
-                not_updated[shop.name] = "Нет файла для актуализации"
-                continue
-
-            data = yaml.safe_load(stream)
-            do_import_task.delay(shop_id, data)
-            updating.append(data["shop"])
-
-        context.update(
-            updating=updating, not_updated=not_updated, already_updated=already_updated
+
+    def make_uptodate_view(self, request):
+        shop_ids = request.GET.get("ids").split(",")
+
+        # загрузка прайс-листов в фоне, результат отображается по ссылке задачи
+        if request.GET.get("background"):
+            task = update_price_lists_task.delay(shop_ids)
+            return redirect("admin:backend_shop_update_result", task_id=task.id)
+
+        context = self.get_result_context(request)
+        context.update(update_price_lists_task(shop_ids))
+        return TemplateResponse(
+            request, "admin/backend/shop/update_result.html", context
         )
+
+    def update_result_view(self, request, task_id):
+        context = self.get_result_context(request)
+        result = AsyncResult(task_id)
+        if result.successful():
+            context.update(result.result)
+        elif result.failed():
+            context.update(error=str(result.result))
+        else:
+            context.update(pending=True)
         return TemplateResponse(
             request, "admin/backend/shop/update_result.html", context
         )
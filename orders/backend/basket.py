@@ -0,0 +1,162 @@
+from collections import Counter
+
+from backend.cache import bump_catalog_version
+from backend.models import Order, OrderItem, ProductInfo
+from django.db import transaction
+from django.db.models import Case, F, When
+from rest_framework.exceptions import ValidationError
+
+
+def add_items(basket, items):
+    """
+    Add {product_info, quantity} items to the basket, quantities of offers
+    already in the basket are summed up. All offers are checked with one
+    query, lines are written in one transaction, nothing is written
+    if any item is invalid. Return numbers of created and updated lines.
+    """
+
+    quantities = Counter()
+    for item in items:
+        quantities[item["product_info"]] += item["quantity"]
+
+    with transaction.atomic():
+        lines = {
+            line.product_info_id: line
+            for line in OrderItem.objects.select_for_update().filter(
+                order=basket, product_info_id__in=quantities
+            )
+        }
+        available = dict(
+            ProductInfo.objects.filter(
+                id__in=quantities, shop__state=True, is_active=True
+            ).values_list("id", "quantity")
+        )
+
+        missing = sorted(quantities.keys() - available.keys())
+        if missing:
+            raise ValidationError(
+                {
+                    "product_info": "Товары не найдены или магазин "
+                    f"не принимает заказы: {missing}"
+                }
+            )
+        for offer_id, line in lines.items():
+            quantities[offer_id] += line.quantity
+        exceeded = sorted(
+            offer_id
+            for offer_id, quantity in quantities.items()
+            if quantity > available[offer_id]
+        )
+        if exceeded:
+            raise ValidationError(
+                {"quantity": f"Недостаточно товара в наличии: {exceeded}"}
+            )
+
+        for offer_id, line in lines.items():
+            line.quantity = quantities[offer_id]
+        OrderItem.objects.bulk_update(lines.values(), ["quantity"])
+        created = OrderItem.objects.bulk_create(
+            [
+                OrderItem(order=basket, product_info_id=offer_id, quantity=quantity)
+                for offer_id, quantity in quantities.items()
+                if offer_id not in lines
+            ]
+        )
+        # отметка изменения корзины для ETag
+        basket.save(update_fields=["updated"])
+    return len(created), len(lines)
+
+
+def update_items(basket, items):
+    """
+    Set quantities of the basket lines by {id, quantity} items, lines with
+    zero quantity are deleted. Lines are read with one query and written
+    with one UPDATE and one DELETE in one transaction. Return ids of
+    updated, deleted and not found lines.
+    """
+
+    quantities = {item["id"]: item["quantity"] for item in items}
+
+    with transaction.atomic():
+        lines = {
+            line.id: line
+            for line in OrderItem.objects.select_for_update(of=("self",))
+            .filter(order=basket, id__in=quantities)
+            .annotate(available=F("product_info__quantity"))
+        }
+        exceeded = sorted(
+            line_id
+            for line_id, line in lines.items()
+            if quantities[line_id] > line.available
+        )
+        if exceeded:
+            raise ValidationError(
+                {"quantity": f"Недостаточно товара в наличии для позиций: {exceeded}"}
+            )
+
+        updated, deleted = [], []
+        for line_id, line in lines.items():
+            line.quantity = quantities[line_id]
+            (updated if line.quantity else deleted).append(line)
+        OrderItem.objects.bulk_update(updated, ["quantity"])
+        if deleted:
+            OrderItem.objects.filter(id__in=[line.id for line in deleted]).delete()
+        if lines:
+            # отметка изменения корзины для ETag
+            basket.save(update_fields=["updated"])
+
+    return (
+        sorted(line.id for line in updated),
+        sorted(line.id for line in deleted),
+        sorted(quantities.keys() - lines.keys()),
+    )
+
+
+def reserve_stock(order):
+    """
+    Subtract quantities of the basket lines from the stock of offers.
+    The basket row is locked first and its lines are read under the lock,
+    so a repeated checkout of the same basket waits and then finds it
+    already ordered. Offers are locked in id order, so concurrent checkouts
+    of the same offers wait for each other instead of deadlocking, and are
+    written with one UPDATE. Nothing is reserved if any offer is short.
+    """
+
+    with transaction.atomic():
+        basket = (
+            Order.objects.select_for_update()
+            .filter(id=order.id, state="basket")
+            .values_list("id", flat=True)
+        )
+        if not basket:
+            raise ValidationError({"state": "Нет заказа со статусом корзины"})
+        quantities = dict(
+            OrderItem.objects.filter(order=order).values_list(
+                "product_info_id", "quantity"
+            )
+        )
+        offers = list(
+            ProductInfo.objects.select_for_update()
+            .filter(id__in=quantities)
+            .order_by("id")
+            .values_list("id", "quantity", "shop_id")
+        )
+        stock = {offer_id: quantity for offer_id, quantity, _ in offers}
+        short = [
+            f"{offer_id}: заказано {quantity}, в наличии {stock.get(offer_id, 0)}"
+            for offer_id, quantity in sorted(quantities.items())
+            if quantity > stock.get(offer_id, 0)
+        ]
+        if short:
+            raise ValidationError({"quantity": short})
+        if quantities:
+            ProductInfo.objects.filter(id__in=quantities).update(
+                quantity=Case(
+                    *(
+                        When(id=offer_id, then=F("quantity") - quantity)
+                        for offer_id, quantity in quantities.items()
+                    )
+                )
+            )
+            # в кэше каталога остатки этих магазинов устарели
+            bump_catalog_version({shop_id for _, _, shop_id in offers})
@@ -0,0 +1,307 @@
+import gc
+import json
+import random
+import tempfile
+import time
+from contextlib import contextmanager
+
+import yaml
+from backend.catalog import refresh_shops
+from backend.models import Delivery, ProductInfo, Shop
+from backend.serializers import (
+    PRODUCT_INFO_VALUES,
+    ProductInfoSerializer,
+    ProductInfoValuesSerializer,
+)
+from backend.tasks import do_import_task
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import connection
+
+Dumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+PARAMETER_VALUES = ("черный", "белый", "красный", "золотистый", "серебристый")
+
+# не в каталоге скачанных прайс-листов: их импорт удаляет, а бенчмарк
+# импортирует один прайс-лист повторно
+BENCHMARK_DIR = "price_lists/benchmark"
+
+BENCHMARK_COLUMNS = (
+    ("goods", "Товаров"),
+    ("scenario", "Сценарий"),
+    ("time", "Время, с"),
+    ("queries", "Запросов"),
+    ("rss", "Пик RSS, МБ"),
+)
+
+SERIALIZER_COLUMNS = (
+    ("goods", "Предложений"),
+    ("serializer", "Сериализатор"),
+    ("time", "Время, с"),
+    ("queries", "Запросов"),
+    ("rss", "Пик RSS, МБ"),
+    ("speedup", "Ускорение"),
+)
+
+
+def generate_goods(categories, goods, parameters, seed=0):
+    """
+    Yield synthetic goods in the shop1.yaml schema
+    """
+
+    rnd = random.Random(seed)
+    # имён параметров больше, чем параметров у товара, как в реальных каталогах
+    names = [f"Параметр {number}" for number in range(1, parameters * 4 + 1)]
+    for number in range(1, goods + 1):
+        price = rnd.randint(100, 200000)
+        yield {
+            "id": number,
+            "category": rnd.randint(1, categories),
+            "model": f"model/{number % 1000}/{number}",
+            "name": f"Товар {number}",
+            "price": price,
+            "price_rrc": price + price // 10,
+            "quantity": rnd.randint(0, 100),
+            "parameters": {
+                name: rnd.choice(
+                    (rnd.randint(1, 1024), round(rnd.uniform(1, 20), 1))
+                    + PARAMETER_VALUES
+                )
+                for name in rnd.sample(names, parameters)
+            },
+        }
+
+
+def generate_price_list(
+    stream, categories=10, goods=1000, parameters=5, seed=0, fmt="yaml"
+):
+    """
+    Write a synthetic price list to a text stream item by item,
+    so the size of the catalog is not limited by memory
+    """
+
+    shop = f"Магазин {goods}"
+    category_list = (
+        {"id": number, "name": f"Категория {number}"}
+        for number in range(1, categories + 1)
+    )
+    goods_list = generate_goods(categories, goods, parameters, seed)
+
+    if fmt == "jsonl":
+        stream.write(json.dumps({"shop": shop}, ensure_ascii=False) + "\n")
+        for section, items in (("categories", category_list), ("goods", goods_list)):
+            for item in items:
+                stream.write(json.dumps({section: item}, ensure_ascii=False) + "\n")
+        return
+
+    stream.write(yaml.dump({"shop": shop}, Dumper=Dumper, allow_unicode=True))
+    for section, items in (("categories", category_list), ("goods", goods_list)):
+        stream.write(f"{section}:\n")
+        for item in items:
+            stream.write(
+                yaml.dump([item], Dumper=Dumper, allow_unicode=True, sort_keys=False)
+            )
+
+
+def reset_peak_rss():
+    """
+    Reset peak resident set size of the process, so the next peak_rss
+    belongs to one scenario. Return False where it is not supported.
+    """
+
+    try:
+        # "5" сбрасывает VmHWM (Linux 4.0+)
+        with open("/proc/self/clear_refs", "w") as fp:
+            fp.write("5")
+    except OSError:
+        return False
+    return True
+
+
+def peak_rss():
+    """
+    Peak resident set size of the process since the last reset in megabytes
+    """
+
+    with open("/proc/self/status") as fp:
+        for line in fp:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 2**10
+    return None
+
+
+def measure(func):
+    """
+    Run func, return wall time, number of queries and peak RSS of the run,
+    RSS is measured on Linux only
+    """
+
+    queries = 0
+
+    def count(execute, sql, params, many, context):
+        nonlocal queries
+        queries += 1
+        return execute(sql, params, many, context)
+
+    gc.collect()
+    # пик за всё время процесса повторял бы максимум предыдущих замеров
+    measure_rss = reset_peak_rss()
+    start = time.perf_counter()
+    with connection.execute_wrapper(count):
+        func()
+    return dict(
+        time=time.perf_counter() - start,
+        queries=queries,
+        rss=peak_rss() if measure_rss else None,
+    )
+
+
+@contextmanager
+def benchmark_database(interactive=True, keepdb=False):
+    """
+    Run benchmarks in the test database, so they never touch the real one
+    """
+
+    old_name = connection.creation.create_test_db(
+        verbosity=0, autoclobber=not interactive, keepdb=keepdb
+    )
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keepdb)
+
+
+@contextmanager
+def generated_shop(goods, categories=10, parameters=5):
+    """
+    New shop with a generated price list saved to the storage,
+    yield the shop and the storage name of the price list
+    """
+
+    with tempfile.TemporaryFile("w+", encoding="utf-8") as stream:
+        generate_price_list(stream, categories, goods, parameters)
+        stream.seek(0)
+        source = default_storage.save(f"{BENCHMARK_DIR}/{goods}", File(stream.buffer))
+    shop = Shop.objects.create(name=f"Магазин {goods}")
+    try:
+        yield shop, source
+    finally:
+        shop.delete()
+        default_storage.delete(source)
+
+
+def run_benchmark(sizes, categories=10, parameters=5, incremental=None):
+    """
+    Import generated price lists of the given sizes into new shops
+    and measure the first import and a forced reimport of each one
+    """
+
+    results = []
+    for goods in sizes:
+        with generated_shop(goods, categories, parameters) as (shop, source):
+            for scenario, force in (("import", False), ("reimport", True)):
+                results.append(
+                    dict(
+                        goods=goods,
+                        scenario=scenario,
+                        **measure(
+                            lambda: do_import_task(
+                                shop.id, source, incremental=incremental, force=force
+                            )
+                        ),
+                    )
+                )
+    return results
+
+
+def run_serializer_benchmark(goods, categories=10, parameters=5):
+    """
+    Serialize all offers of a generated shop with ProductInfoSerializer
+    and with ProductInfoValuesSerializer
+    """
+
+    with generated_shop(goods, categories, parameters) as (shop, source):
+        do_import_task(shop.id, source)
+        Delivery.objects.bulk_create(
+            [
+                Delivery(shop=shop, min_sum=0, cost=500),
+                Delivery(shop=shop, min_sum=10000, cost=0),
+            ]
+        )
+        refresh_shops([shop.id])
+        offers = ProductInfo.objects.filter(shop=shop).order_by("id")
+        serializers = (
+            (
+                "ProductInfoSerializer",
+                lambda: ProductInfoSerializer(
+                    offers.select_related("shop", "product__category").prefetch_related(
+                        "shop__delivery", "product_parameters__parameter"
+                    ),
+                    many=True,
+                ).data,
+            ),
+            (
+                "ProductInfoValuesSerializer",
+                lambda: ProductInfoValuesSerializer(
+                    offers.values(*PRODUCT_INFO_VALUES), many=True
+                ).data,
+            ),
+        )
+        results = [
+            dict(goods=goods, serializer=name, **measure(serialize))
+            for name, serialize in serializers
+        ]
+    results[1]["speedup"] = results[0]["time"] / results[1]["time"]
+    return results
+
+
+def compare_results(results, baseline, tolerance=0.2):
+    """
+    Add changes against baseline results, return rows with regressions:
+    time grown more than tolerance or more queries
+    """
+
+    previous = {(row["goods"], row["scenario"]): row for row in baseline}
+    regressions = []
+    for row in results:
+        base = previous.get((row["goods"], row["scenario"]))
+        if base is None:
+            continue
+        row["time_change"] = row["time"] / base["time"] - 1 if base["time"] else 0
+        row["queries_change"] = row["queries"] - base["queries"]
+        if row["time_change"] > tolerance or row["queries_change"] > 0:
+            regressions.append(row)
+    return regressions
+
+
+def format_table(results, columns=BENCHMARK_COLUMNS):
+    """
+    Results as a text table, with changes if they were compared
+    """
+
+    columns = list(columns)
+    if any("time_change" in row for row in results):
+        columns += [("time_change", "Δ время"), ("queries_change", "Δ запросов")]
+
+    def cell(row, key):
+        value = row.get(key)
+        if value is None:
+            return "-"
+        if key == "time_change":
+            return f"{value:+.0%}"
+        if key == "queries_change":
+            return f"{value:+d}"
+        if isinstance(value, float):
+            return f"{value:.2f}"
+        return str(value)
+
+    rows = [[title for _, title in columns]] + [
+        [cell(row, key) for key, _ in columns] for row in results
+    ]
+    widths = [max(len(row[number]) for row in rows) for number in range(len(columns))]
+    lines = [
+        "  ".join(value.rjust(width) for value, width in zip(row, widths))
+        for row in rows
+    ]
+    lines.insert(1, "  ".join("-" * width for width in widths))
+    return "\n".join(lines)
@@ -0,0 +1,110 @@
+import hashlib
+import uuid
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+# base - общие данные каталога (категории), all - любые изменения каталога,
+# shop:<id> - данные одного магазина
+VERSION_KEY = "catalog:version:{}"
+
+
+def get_catalog_version(shop_id=None):
+    """
+    Version of the whole catalog or of the catalog of one shop
+    """
+
+    names = ["all"] if shop_id is None else ["base", f"shop:{shop_id}"]
+    keys = [VERSION_KEY.format(name) for name in names]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # версии не истекают, add не перезапишет версию другого процесса
+            cache.add(key, uuid.uuid4().hex, timeout=None)
+            versions[key] = cache.get(key)
+    return ".".join(versions[key] for key in keys)
+
+
+def bump_catalog_version(shop_ids=None):
+    """
+    Invalidate cached responses of the shops or of the whole catalog
+    after the current transaction is committed
+    """
+
+    names = ["all"]
+    if shop_ids is None:
+        names.append("base")
+    else:
+        names += [f"shop:{shop_id}" for shop_id in shop_ids]
+    versions = {VERSION_KEY.format(name): uuid.uuid4().hex for name in names}
+    # до фиксации транзакции читатели могут закэшировать старые данные с новой версией
+    transaction.on_commit(lambda: cache.set_many(versions, timeout=None))
+
+
+def make_etag(*parts):
+    return '"{}"'.format(hashlib.sha1(":".join(map(str, parts)).encode()).hexdigest())
+
+
+def not_modified(request, etag):
+    """
+    304 response if If-None-Match of the request matches etag
+    """
+
+    etags = parse_etags(request.headers.get("If-None-Match", ""))
+    if etag in etags or "*" in etags:
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    return None
+
+
+def get_orders_etag(request, orders):
+    """
+    ETag of the orders list from modification stamps of the orders
+    and the catalog version, since the orders show current offers
+    """
+
+    stamp = orders.aggregate(updated=Max("updated"), count=Count("id"))
+    return make_etag(
+        request.user.id,
+        stamp["updated"],
+        stamp["count"],
+        get_catalog_version(),
+        request.accepted_renderer.format,
+    )
+
+
+class CatalogCacheMixin:
+    """
+    Cache list responses by the catalog version and query parameters,
+    cached responses are served without database queries.
+    ETag is made of the same data, so If-None-Match is checked
+    before any query or serialization.
+    """
+
+    def get_catalog_shop_id(self):
+        return None
+
+    def list(self, request, *args, **kwargs):
+        # версию читаем до запроса к базе, чтобы не закэшировать
+        # под новой версией данные, прочитанные до импорта
+        version = get_catalog_version(self.get_catalog_shop_id())
+        query = urlencode(sorted(request.query_params.lists()), doseq=True)
+        # ссылки next и previous пагинации абсолютные: схема и хост в ключе
+        url = request.build_absolute_uri(request.path)
+        digest = hashlib.sha1(f"{version}:{url}?{query}".encode()).hexdigest()
+        etag = make_etag(digest, request.accepted_renderer.format)
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
+
+        key = f"catalog:response:{digest}"
+        data = cache.get(key)
+        if data is None:
+            data = super().list(request, *args, **kwargs).data
+            cache.set(key, data, settings.CATALOG_CACHE_TIMEOUT)
+        return Response(data, headers={"ETag": etag})
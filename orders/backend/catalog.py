@@ -0,0 +1,112 @@
+import re
+
+from backend.models import Delivery, ProductInfo, ProductParameter, Shop
+from backend.postgres import NUMBER_PATTERN, update_offer_documents, use_postgresql
+
+# поля предложения, которые строит refresh_offers
+DOCUMENT_FIELDS = (
+    "search_text",
+    "parameters",
+    "numeric_parameters",
+    "product_name",
+    "category",
+    "category_name",
+    "parameter_list",
+)
+
+
+def refresh_offers(offers, batch_size):
+    """
+    Build search text (and vector on PostgreSQL), filter parameters
+    and product data of the read model for the offers queryset
+    """
+
+    if use_postgresql():
+        update_offer_documents(offers)
+        return
+
+    ids = list(offers.values_list("id", flat=True))
+    for start in range(0, len(ids), batch_size):
+        batch = ids[start : start + batch_size]
+        documents = {
+            offer_id: ProductInfo(
+                id=offer_id,
+                search_text=[name, model],
+                parameters={},
+                numeric_parameters={},
+                product_name=name,
+                category_id=category_id,
+                category_name=category_name,
+                parameter_list=[],
+            )
+            for offer_id, name, model, category_id, category_name in (
+                ProductInfo.objects.filter(id__in=batch).values_list(
+                    "id",
+                    "product__name",
+                    "model",
+                    "product__category_id",
+                    "product__category__name",
+                )
+            )
+        }
+        values = (
+            ProductParameter.objects.filter(product_info_id__in=batch)
+            .order_by("id")
+            .values_list("product_info_id", "parameter__name", "value")
+        )
+        for offer_id, name, value in values:
+            document = documents[offer_id]
+            document.search_text.append(value)
+            document.parameters[name] = value
+            if re.match(NUMBER_PATTERN, value):
+                document.numeric_parameters[name] = float(value.replace(",", "."))
+            document.parameter_list.append([name, value])
+        for document in documents.values():
+            document.search_text = " ".join(filter(None, document.search_text))
+        ProductInfo.objects.bulk_update(documents.values(), DOCUMENT_FIELDS)
+
+
+def refresh_shops(shop_ids):
+    """
+    Copy name, state and delivery of the shops to their offers,
+    only offers with outdated data are written
+    """
+
+    shop_ids = list(shop_ids)
+    deliveries = {shop_id: [] for shop_id in shop_ids}
+    rows = (
+        Delivery.objects.filter(shop_id__in=shop_ids)
+        .order_by("shop", "min_sum")
+        .values_list("shop_id", "min_sum", "cost")
+    )
+    for shop_id, min_sum, cost in rows:
+        deliveries[shop_id].append([min_sum, cost])
+
+    for shop_id, name, state in Shop.objects.filter(id__in=shop_ids).values_list(
+        "id", "name", "state"
+    ):
+        data = dict(shop_name=name, shop_state=state, shop_delivery=deliveries[shop_id])
+        ProductInfo.objects.filter(shop_id=shop_id).exclude(**data).update(**data)
+
+
+def refresh_category(category):
+    ProductInfo.objects.filter(category_id=category.id).exclude(
+        category_name=category.name
+    ).update(category_name=category.name)
+
+
+def backfill_catalog(batch_size):
+    """
+    Fill the read model of offers which have never been refreshed, such as
+    the whole catalog right after the read model columns were added.
+    Return the number of filled offers.
+    """
+
+    offers = ProductInfo.objects.filter(parameter_list__isnull=True)
+    shop_ids = set(offers.values_list("shop_id", flat=True).distinct())
+    if not shop_ids:
+        return 0
+    count = offers.count()
+    refresh_offers(offers, batch_size)
+    refresh_shops(shop_ids)
+    return count
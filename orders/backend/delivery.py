@@ -0,0 +1,30 @@
+from bisect import bisect_right
+
+
+class DeliveryTiers:
+    """
+    Delivery costs of shops by the order sum: min_sum thresholds
+    of every shop are sorted once and searched with bisect
+    """
+
+    def __init__(self, rows):
+        self.tiers = {}
+        for shop_id, min_sum, cost in sorted(rows):
+            thresholds, costs = self.tiers.setdefault(shop_id, ([], []))
+            thresholds.append(min_sum)
+            costs.append(cost)
+
+    def resolve(self, shop_id, shop_sum):
+        """
+        Return delivery cost of the shop sum and None
+        or None and the delivery error
+        """
+
+        if shop_id not in self.tiers:
+            return None, "стоимость доставки недоступна."
+        thresholds, costs = self.tiers[shop_id]
+        # подходит последний порог не больше суммы
+        index = bisect_right(thresholds, shop_sum)
+        if not index:
+            return None, "сумма заказа меньше минимальной."
+        return costs[index - 1], None
@@ -0,0 +1,90 @@
+import hashlib
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import requests as rqs
+from backend.importer import save_price_list
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# source - имя сохранённого прайс-листа, not_modified - прайс-лист не изменился
+FetchResult = namedtuple(
+    "FetchResult",
+    ["source", "error", "etag", "last_modified", "not_modified"],
+    defaults=[None, None, "", "", False],
+)
+
+
+def make_session():
+    """
+    HTTP session with connection pool per host and retries
+    """
+
+    adapter = HTTPAdapter(
+        pool_maxsize=settings.PRICE_LIST_FETCH_HOST_CONNECTIONS,
+        # не открываем к одному хосту больше соединений, чем размер пула
+        pool_block=True,
+        max_retries=Retry(
+            total=settings.PRICE_LIST_FETCH_RETRIES,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            raise_on_status=False,
+        ),
+    )
+    session = rqs.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def fetch_price_list(session, shop):
+    """
+    Download shop price list with a conditional request
+    and save it to the storage if it was changed
+    """
+
+    headers = {}
+    if shop.source_etag:
+        headers["If-None-Match"] = shop.source_etag
+    if shop.source_last_modified:
+        headers["If-Modified-Since"] = shop.source_last_modified
+
+    try:
+        result = session.get(
+            shop.url, headers=headers, timeout=settings.PRICE_LIST_FETCH_TIMEOUT
+        )
+    except rqs.exceptions.Timeout:
+        return FetchResult(error="Превышено время ожидания")
+    except rqs.exceptions.RequestException:
+        return FetchResult(error="Нет соединения")
+
+    if result.status_code == 304:
+        return FetchResult(not_modified=True)
+    if not result.ok:
+        return FetchResult(error="Файл не найден")
+
+    etag = result.headers.get("ETag", "")
+    last_modified = result.headers.get("Last-Modified", "")
+    if hashlib.sha256(result.content).hexdigest() == shop.source_sha256:
+        return FetchResult(etag=etag, last_modified=last_modified, not_modified=True)
+    return FetchResult(
+        source=save_price_list(result.content),
+        etag=etag,
+        last_modified=last_modified,
+    )
+
+
+def fetch_price_lists(shops):
+    """
+    Download price lists of the shops concurrently,
+    results are in the order of shops
+    """
+
+    if not shops:
+        return []
+
+    with make_session() as session, ThreadPoolExecutor(
+        max_workers=min(len(shops), settings.PRICE_LIST_FETCH_WORKERS)
+    ) as executor:
+        return list(executor.map(lambda shop: fetch_price_list(session, shop), shops))
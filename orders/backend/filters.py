@@ -0,0 +1,124 @@
+import re
+from collections import defaultdict
+from functools import reduce
+from operator import or_
+
+from backend.models import ProductParameter
+from backend.postgres import NUMBER_PATTERN, parameter_facets, use_postgresql
+from django.db.models import Count, Q
+from django.db.models.fields.json import KeyTextTransform, KeyTransform
+from rest_framework.exceptions import ValidationError
+
+# параметры запроса диапазонных фильтров и их лукапы
+RANGE_FILTERS = (("parameter_min", "gte"), ("parameter_max", "lte"))
+
+
+def split_filter(param, item):
+    """
+    Split "name:value" filter of the query parameter
+    """
+
+    name, separator, value = item.rpartition(":")
+    if not separator or not name or not value:
+        raise ValidationError(
+            {param: f"Фильтр '{item}' должен иметь вид 'имя параметра:значение'"}
+        )
+    return name, value
+
+
+def filter_parameters(queryset, query_params):
+    """
+    Filter offers by parameter values: parameter=name:value (several values
+    of one parameter match any of them), parameter_min=name:number
+    and parameter_max=name:number.
+
+    On PostgreSQL exact values are matched with @> over the GIN index
+    of parameters, ranges are checked over numeric_parameters.
+    """
+
+    values = defaultdict(list)
+    for item in query_params.getlist("parameter"):
+        name, value = split_filter("parameter", item)
+        values[name].append(value)
+
+    for number, (name, options) in enumerate(values.items()):
+        if use_postgresql():
+            queryset = queryset.filter(
+                reduce(
+                    or_, (Q(parameters__contains={name: value}) for value in options)
+                )
+            )
+        else:
+            alias = f"parameter_{number}"
+            queryset = queryset.alias(
+                **{alias: KeyTextTransform(name, "parameters")}
+            ).filter(**{f"{alias}__in": options})
+
+    for param, lookup in RANGE_FILTERS:
+        for number, item in enumerate(query_params.getlist(param)):
+            name, value = split_filter(param, item)
+            if not re.match(NUMBER_PATTERN, value):
+                raise ValidationError({param: f"Значение '{value}' не является числом"})
+            value = float(value.replace(",", "."))
+            alias = f"{param}_{number}"
+            # наличие ключа проверяется по GIN-индексу, сравнение - только у найденных
+            queryset = queryset.alias(
+                **{alias: KeyTransform(name, "numeric_parameters")}
+            ).filter(
+                **{"numeric_parameters__has_key": name, f"{alias}__{lookup}": value}
+            )
+    return queryset
+
+
+def id_param(query_params, param):
+    """
+    Integer id of the query parameter or None if it is not given
+    """
+
+    value = query_params.get(param)
+    if not value:
+        return None
+    # isdigit() пропускает и символы вроде "²", которые int() не разбирает
+    if not re.fullmatch(r"[0-9]+", value):
+        raise ValidationError({param: f"Значение '{value}' не является номером"})
+    return int(value)
+
+
+def filter_offers(queryset, query_params):
+    """
+    Filter offers by price_min, price_max and in_stock
+    """
+
+    for param, lookup in (("price_min", "price__gte"), ("price_max", "price__lte")):
+        value = query_params.get(param)
+        if value is None:
+            continue
+        # isdigit() пропускает и символы вроде "²", которые int() не разбирает
+        if not re.fullmatch(r"[0-9]+", value):
+            raise ValidationError({param: f"Значение '{value}' не является ценой"})
+        queryset = queryset.filter(**{lookup: int(value)})
+    if query_params.get("in_stock", "").lower() in ("1", "true"):
+        queryset = queryset.filter(quantity__gt=0)
+    return queryset
+
+
+def get_facets(queryset):
+    """
+    Count offers of the queryset by parameter values with one query,
+    return {name: {value: count}} with the most frequent values first
+    """
+
+    if use_postgresql():
+        rows = parameter_facets(queryset)
+    else:
+        rows = (
+            ProductParameter.objects.filter(product_info_id__in=queryset.values("id"))
+            .values_list("parameter__name", "value")
+            .annotate(count=Count("id"))
+            .order_by()
+        )
+
+    facets = defaultdict(dict)
+    for name, value, count in sorted(rows, key=lambda row: (row[0], -row[2], row[1])):
+        facets[name][value] = count
+    return dict(facets)
@@ -0,0 +1,548 @@
+import hashlib
+import json
+import uuid
+from datetime import timedelta
+
+from backend.catalog import refresh_offers
+from backend.models import (
+    Category,
+    OrderItem,
+    Parameter,
+    Product,
+    ProductInfo,
+    ProductParameter,
+    Shop,
+    StagedOffer,
+)
+from backend.postgres import copy_objects, merge_staged_offers, use_copy
+from backend.readers import read_price_list
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+BLOB_DIR = "price_lists/blobs"
+CHUNK_DIR = "price_lists/chunks"
+
+
+def save_price_list(content):
+    """
+    Save downloaded price list as a blob named by its content hash,
+    return its storage name. Every import gets its own blob (the storage
+    adds a suffix to a taken name), so removing it after the import
+    does not affect other queued imports of the same content.
+    """
+
+    return default_storage.save(
+        f"{BLOB_DIR}/{hashlib.sha256(content).hexdigest()}", ContentFile(content)
+    )
+
+
+def remove_price_list(name):
+    """
+    Delete the downloaded price list blob, stored shop files are kept
+    """
+
+    if name.startswith(f"{BLOB_DIR}/"):
+        default_storage.delete(name)
+
+
+def price_list_sha256(name):
+    digest = hashlib.sha256()
+    with default_storage.open(name) as stream:
+        for chunk in stream.chunks():
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_price_list(name):
+    """
+    Read price list from the storage record by record
+    """
+
+    with default_storage.open(name) as stream:
+        yield from read_price_list(stream)
+
+
+def acquire_import_lock(shop_id):
+    """
+    Mark the shop as being imported, return import id
+    or None if another import of the shop is running.
+    Staged offers and chunks of the import whose lock has expired are removed.
+    """
+
+    import_id = uuid.uuid4().hex
+    now = timezone.now()
+    expired = now - timedelta(seconds=settings.IMPORT_LOCK_TIMEOUT)
+    with transaction.atomic():
+        previous = (
+            Shop.objects.select_for_update()
+            .filter(Q(import_id="") | Q(import_started__lt=expired), id=shop_id)
+            .values_list("import_id", flat=True)
+            .first()
+        )
+        if previous is None:
+            return None
+        Shop.objects.filter(id=shop_id).update(import_id=import_id, import_started=now)
+    if previous:
+        # рабочий процесс прерванного импорта упал и не убрал за собой
+        discard_staged(previous)
+    return import_id
+
+
+def release_import_lock(shop_id, import_id):
+    Shop.objects.filter(id=shop_id, import_id=import_id).update(
+        import_id="", import_started=None
+    )
+
+
+def discard_staged(import_id):
+    """
+    Remove staged offers and chunks of the import
+    """
+
+    StagedOffer.objects.filter(import_id=import_id).delete()
+    directory = f"{CHUNK_DIR}/{import_id}"
+    try:
+        _, files = default_storage.listdir(directory)
+    except FileNotFoundError:
+        files = []
+    for name in files:
+        default_storage.delete(f"{directory}/{name}")
+
+
+def discard_import(shop_id, import_id):
+    """
+    Remove staged offers and chunks of an unfinished import and release the lock
+    """
+
+    discard_staged(import_id)
+    release_import_lock(shop_id, import_id)
+
+
+OFFER_FIELDS = ("model", "price", "price_rrc", "quantity")
+
+
+class PriceListImporter:
+    """
+    Bulk import of a shop price list.
+
+    Categories, products and parameters are resolved with set-based lookups,
+    offers and their parameters are written with batched inserts, so every
+    batch of goods costs a fixed number of queries.
+
+    Goods are matched with the current offers of the shop by (product,
+    external_id): new offers are inserted, vanished ones are removed and
+    existing ones are updated in place, in incremental mode only if changed.
+
+    Goods are resolved, compared with the catalog and saved as staged offers
+    first (stage), then the catalog of the shop is switched to them in one
+    short transaction (merge_staged), so readers never see a partial catalog.
+    Partitioned import splits the goods into chunks (split) which are staged
+    in parallel.
+
+    On PostgreSQL staged offers are loaded with COPY and merged into the
+    catalog with set-based statements, other databases use batched ORM queries.
+    """
+
+    def __init__(self, shop, batch_size=None, incremental=None):
+        self.shop = shop
+        self.batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+        if incremental is None:
+            incremental = settings.IMPORT_INCREMENTAL
+        self.incremental = incremental
+        # имена параметров повторяются во всех товарах, поэтому кэшируем их
+        self.parameter_ids = {}
+        self.report = dict(inserted=0, updated=0, unchanged=0, removed=0)
+
+    def run(self, records, import_id):
+        """
+        Import (section, value) records of a price list
+        """
+
+        self.stage(records, import_id)
+        return self.merge_staged(import_id)
+
+    def split(self, records, import_id):
+        """
+        Import categories and save goods as JSON-lines chunks
+        of IMPORT_CHUNK_SIZE items, return their storage names
+        """
+
+        chunks = []
+        for goods in self.read_goods(records, settings.IMPORT_CHUNK_SIZE):
+            content = "\n".join(
+                json.dumps({"goods": item}, ensure_ascii=False) for item in goods
+            )
+            chunks.append(
+                default_storage.save(
+                    f"{CHUNK_DIR}/{import_id}/{len(chunks)}.jsonl",
+                    ContentFile(content.encode()),
+                )
+            )
+        return chunks
+
+    def stage(self, records, import_id):
+        """
+        Resolve goods, compare them with the catalog
+        and save them as staged offers together with the changes plan
+        """
+
+        for goods in self.read_goods(records, self.batch_size):
+            offers = self.resolve_goods(goods)
+            existing = self.fetch_offers(offers)
+            staged = []
+            for key, (fields, parameters) in offers.items():
+                offer_id, current_fields, current_parameters = existing.get(
+                    key, (None, fields, parameters)
+                )
+                # полный импорт переписывает все предложения на месте
+                staged.append(
+                    StagedOffer(
+                        import_id=import_id,
+                        shop_id=self.shop.id,
+                        product_id=key[0],
+                        external_id=key[1],
+                        # пары [ИД параметра, значение] в порядке прайс-листа
+                        parameters=list(parameters.items()),
+                        offer_id=offer_id,
+                        fields_changed=not self.incremental or fields != current_fields,
+                        parameters_changed=not self.incremental
+                        or list(parameters.items()) != list(current_parameters.items()),
+                        **fields,
+                    )
+                )
+            if use_copy():
+                copy_objects(StagedOffer, staged)
+            else:
+                StagedOffer.objects.bulk_create(staged, batch_size=self.batch_size)
+
+    def merge_staged(self, import_id):
+        """
+        Apply the changes plan of staged offers to the catalog of the shop
+        """
+
+        staged = StagedOffer.objects.filter(import_id=import_id)
+        existing = staged.filter(offer_id__isnull=False)
+        counts = staged.aggregate(
+            total=Count("id"),
+            inserted=Count("id", filter=Q(offer_id__isnull=True)),
+            updated=Count(
+                "id",
+                filter=Q(offer_id__isnull=False)
+                & (Q(fields_changed=True) | Q(parameters_changed=True)),
+            ),
+        )
+
+        # сравнение уже выполнено при загрузке, в транзакции только запись
+        with transaction.atomic():
+            self.report["removed"] = self.remove_offers(
+                ProductInfo.objects.filter(shop_id=self.shop.id).exclude(
+                    id__in=existing.values("offer_id")
+                )
+            )
+
+            changed = existing.filter(parameters_changed=True)
+            ProductParameter.objects.filter(
+                product_info_id__in=changed.values("offer_id")
+            ).delete()
+            if use_copy():
+                merge_staged_offers(import_id)
+            else:
+                self.merge_staged_orm(staged)
+            # модель чтения новых и изменённых предложений, а также ещё
+            # не заполненных после обновления схемы; данные магазина
+            # обновятся при его сохранении (backend.signals)
+            refresh_offers(
+                ProductInfo.objects.filter(
+                    Q(parameter_list__isnull=True)
+                    | Q(
+                        id__in=existing.filter(
+                            Q(fields_changed=True) | Q(parameters_changed=True)
+                        ).values("offer_id")
+                    ),
+                    shop_id=self.shop.id,
+                ),
+                self.batch_size,
+            )
+
+            self.shop.is_uptodate = True
+            self.shop.save(
+                update_fields=[
+                    "name",
+                    "is_uptodate",
+                    "source_etag",
+                    "source_last_modified",
+                    "source_sha256",
+                ]
+            )
+
+        staged.delete()
+        self.report.update(
+            inserted=counts["inserted"],
+            updated=counts["updated"],
+            unchanged=counts["total"] - counts["inserted"] - counts["updated"],
+        )
+        return self.report
+
+    def merge_staged_orm(self, staged):
+        existing = staged.filter(offer_id__isnull=False)
+        for batch in self.iterate(existing.filter(fields_changed=True)):
+            ProductInfo.objects.bulk_update(
+                [
+                    ProductInfo(
+                        id=offer.offer_id, is_active=True, **self.unstage(offer)[1][0]
+                    )
+                    for offer in batch
+                ],
+                (*OFFER_FIELDS, "is_active"),
+            )
+
+        for batch in self.iterate(existing.filter(parameters_changed=True)):
+            self.write_parameters(
+                {offer.offer_id: self.unstage(offer)[1][1] for offer in batch}
+            )
+
+        for batch in self.iterate(staged.filter(offer_id__isnull=True)):
+            self.insert_offers(dict(map(self.unstage, batch)))
+
+    def iterate(self, queryset):
+        """
+        Iterate queryset in batches of batch_size rows ordered by id
+        """
+
+        queryset = queryset.order_by("id")
+        last_id = 0
+        while batch := list(queryset.filter(id__gt=last_id)[: self.batch_size]):
+            last_id = batch[-1].id
+            yield batch
+
+    @staticmethod
+    def unstage(offer):
+        return (offer.product_id, offer.external_id), (
+            {field: getattr(offer, field) for field in OFFER_FIELDS},
+            dict(offer.parameters),
+        )
+
+    def read_goods(self, records, size):
+        """
+        Import shop name and categories, yield goods in chunks of size items
+        """
+
+        categories, goods = [], []
+        for section, value in records:
+            if section == "shop":
+                self.shop.name = value
+            elif section == "categories":
+                categories.append(value)
+            elif section == "goods":
+                if categories:
+                    self.import_categories(categories)
+                    categories = []
+                goods.append(value)
+                if len(goods) >= size:
+                    yield goods
+                    goods = []
+        if categories:
+            self.import_categories(categories)
+        if goods:
+            yield goods
+
+    def import_categories(self, categories):
+        names = {category["id"]: category["name"] for category in categories}
+        existing_ids = set(
+            Category.objects.filter(id__in=names).values_list("id", flat=True)
+        )
+        Category.objects.bulk_create(
+            [
+                Category(id=category_id, name=name)
+                for category_id, name in names.items()
+                if category_id not in existing_ids
+            ],
+            batch_size=self.batch_size,
+        )
+
+        CategoryShop = Category.shops.through
+        CategoryShop.objects.bulk_create(
+            [
+                CategoryShop(category_id=category_id, shop_id=self.shop.id)
+                for category_id in names
+            ],
+            batch_size=self.batch_size,
+            ignore_conflicts=True,
+        )
+
+    def resolve_goods(self, goods):
+        """
+        Map (product_id, external_id) pairs of the goods
+        to (fields, {parameter_id: value}) tuples
+        """
+
+        product_ids = self.get_product_ids(
+            {(item["name"], item["category"]) for item in goods}
+        )
+        parameter_ids = self.get_parameter_ids(
+            {name for item in goods for name in item["parameters"]}
+        )
+        offers = {}
+        for item in goods:
+            key = (product_ids[item["name"], item["category"]], item["id"])
+            offers[key] = (
+                {field: item[field] for field in OFFER_FIELDS},
+                {
+                    parameter_ids[name]: str(value)
+                    for name, value in item["parameters"].items()
+                },
+            )
+        return offers
+
+    def insert_offers(self, offers):
+        # повторы одного предложения в прайс-листе пропускаем
+        ProductInfo.objects.bulk_create(
+            [
+                ProductInfo(
+                    product_id=product_id,
+                    external_id=external_id,
+                    shop_id=self.shop.id,
+                    **fields,
+                )
+                for (product_id, external_id), (fields, _) in offers.items()
+            ],
+            batch_size=self.batch_size,
+            ignore_conflicts=True,
+        )
+        # bulk_create возвращает id не на всех СУБД, поэтому перечитываем их
+        created = self.fetch_offers(offers, with_parameters=False)
+        self.write_parameters(
+            {
+                created[key][0]: parameters
+                for key, (_, parameters) in offers.items()
+                if key in created
+            }
+        )
+
+    def fetch_offers(self, keys, with_parameters=True):
+        """
+        Map (product_id, external_id) pairs of the shop offers
+        to (id, fields, parameters) tuples
+        """
+
+        keys = set(keys)
+        rows = ProductInfo.objects.filter(
+            shop_id=self.shop.id,
+            external_id__in={external_id for _, external_id in keys},
+        ).values_list("product_id", "external_id", "id", "is_active", *OFFER_FIELDS)
+        offers = {}
+        for product_id, external_id, offer_id, is_active, *values in rows:
+            if (product_id, external_id) in keys:
+                offers[product_id, external_id] = (
+                    offer_id,
+                    # снятое с продажи предложение вернулось в прайс-лист
+                    dict(zip(OFFER_FIELDS, values)) if is_active else None,
+                    {},
+                )
+
+        if with_parameters and offers:
+            offer_parameters = {
+                offer_id: parameters for offer_id, _, parameters in offers.values()
+            }
+            rows = (
+                ProductParameter.objects.filter(product_info_id__in=offer_parameters)
+                .order_by("id")
+                .values_list("product_info_id", "parameter_id", "value")
+            )
+            for offer_id, parameter_id, value in rows:
+                offer_parameters[offer_id][parameter_id] = value
+        return offers
+
+    def write_parameters(self, offer_parameters):
+        ProductParameter.objects.bulk_create(
+            [
+                ProductParameter(
+                    product_info_id=offer_id, parameter_id=parameter_id, value=value
+                )
+                for offer_id, parameters in offer_parameters.items()
+                for parameter_id, value in parameters.items()
+            ],
+            batch_size=self.batch_size,
+            ignore_conflicts=True,
+        )
+
+    @staticmethod
+    def remove_offers(queryset):
+        """
+        Delete vanished offers. Offers of placed orders are retired instead:
+        they stay for the order lines, but leave the catalog with no stock.
+        Return the number of removed offers.
+        """
+
+        queryset = queryset.filter(is_active=True)
+        ordered = OrderItem.objects.exclude(order__state="basket").values(
+            "product_info_id"
+        )
+        retired = queryset.filter(id__in=ordered).update(is_active=False, quantity=0)
+        _, deleted = queryset.exclude(id__in=ordered).delete()
+        return retired + deleted.get(ProductInfo._meta.label, 0)
+
+    def get_product_ids(self, keys):
+        """
+        Map (name, category_id) pairs to product ids, creating missing products
+        """
+
+        product_ids = self.fetch_product_ids(keys)
+        missing = keys - product_ids.keys()
+        if missing:
+            Product.objects.bulk_create(
+                [
+                    Product(name=name, category_id=category_id)
+                    for name, category_id in missing
+                ],
+                batch_size=self.batch_size,
+            )
+            product_ids.update(self.fetch_product_ids(missing))
+        return product_ids
+
+    @staticmethod
+    def fetch_product_ids(keys):
+        product_ids = {}
+        # параллельные импорты могут создать дубликаты, берём самый старый
+        rows = (
+            Product.objects.filter(
+                name__in={name for name, _ in keys},
+                category_id__in={category_id for _, category_id in keys},
+            )
+            .order_by("id")
+            .values_list("name", "category_id", "id")
+        )
+        for name, category_id, product_id in rows:
+            if (name, category_id) in keys:
+                product_ids.setdefault((name, category_id), product_id)
+        return product_ids
+
+    def get_parameter_ids(self, names):
+        """
+        Map parameter names to ids, creating missing parameters
+        """
+
+        missing = names - self.parameter_ids.keys()
+        if missing:
+            self.parameter_ids.update(self.fetch_parameter_ids(missing))
+            missing = missing - self.parameter_ids.keys()
+        if missing:
+            Parameter.objects.bulk_create(
+                [Parameter(name=name) for name in missing],
+                batch_size=self.batch_size,
+            )
+            self.parameter_ids.update(self.fetch_parameter_ids(missing))
+        return self.parameter_ids
+
+    @staticmethod
+    def fetch_parameter_ids(names):
+        # при дубликатах последним в словарь попадает самый старый параметр
+        return (
+            Parameter.objects.filter(name__in=names)
+            .order_by("-id")
+            .values_list("name", "id")
+        )
@@ -0,0 +1,77 @@
+import json
+
+from backend.benchmark import (
+    benchmark_database,
+    compare_results,
+    format_table,
+    run_benchmark,
+)
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        "Замер импорта сгенерированных прайс-листов: время, число запросов "
+        "и пик RSS. Импорт выполняется в тестовой базе данных."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--goods",
+            type=int,
+            nargs="+",
+            default=[1000, 10000],
+            help="Размеры прайс-листов",
+        )
+        parser.add_argument("--categories", type=int, default=10)
+        parser.add_argument(
+            "--parameters", type=int, default=5, help="Параметров у товара"
+        )
+        parser.add_argument(
+            "--full", action="store_true", help="Полный, а не инкрементальный импорт"
+        )
+        parser.add_argument("--save", help="Сохранить результаты в JSON-файл")
+        parser.add_argument("--compare", help="Сравнить с результатами из JSON-файла")
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.2,
+            help="Допустимое замедление при сравнении, доля",
+        )
+        parser.add_argument(
+            "--noinput",
+            action="store_false",
+            dest="interactive",
+            help="Удалять оставшуюся тестовую базу данных без подтверждения",
+        )
+        parser.add_argument(
+            "--keepdb", action="store_true", help="Не удалять тестовую базу данных"
+        )
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options["compare"]:
+            with open(options["compare"], encoding="utf-8") as fp:
+                baseline = json.load(fp)
+
+        with benchmark_database(options["interactive"], options["keepdb"]):
+            results = run_benchmark(
+                sorted(options["goods"]),
+                categories=options["categories"],
+                parameters=options["parameters"],
+                incremental=False if options["full"] else None,
+            )
+
+        if options["save"]:
+            with open(options["save"], "w", encoding="utf-8") as fp:
+                json.dump(results, fp, ensure_ascii=False, indent=2)
+        regressions = []
+        if baseline is not None:
+            regressions = compare_results(results, baseline, options["tolerance"])
+        self.stdout.write(format_table(results))
+
+        if regressions:
+            raise CommandError(
+                "Импорт стал медленнее: "
+                + ", ".join(f"{row['goods']} {row['scenario']}" for row in regressions)
+            )
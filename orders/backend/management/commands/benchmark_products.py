@@ -0,0 +1,39 @@
+from backend.benchmark import (
+    SERIALIZER_COLUMNS,
+    benchmark_database,
+    format_table,
+    run_serializer_benchmark,
+)
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Замер сериализации предложений каталога: ProductInfoSerializer "
+        "и ProductInfoValuesSerializer. Выполняется в тестовой базе данных."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--goods", type=int, default=100000)
+        parser.add_argument("--categories", type=int, default=10)
+        parser.add_argument(
+            "--parameters", type=int, default=5, help="Параметров у товара"
+        )
+        parser.add_argument(
+            "--noinput",
+            action="store_false",
+            dest="interactive",
+            help="Удалять оставшуюся тестовую базу данных без подтверждения",
+        )
+        parser.add_argument(
+            "--keepdb", action="store_true", help="Не удалять тестовую базу данных"
+        )
+
+    def handle(self, *args, **options):
+        with benchmark_database(options["interactive"], options["keepdb"]):
+            results = run_serializer_benchmark(
+                options["goods"],
+                categories=options["categories"],
+                parameters=options["parameters"],
+            )
+        self.stdout.write(format_table(results, SERIALIZER_COLUMNS))
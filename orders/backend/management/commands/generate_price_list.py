@@ -0,0 +1,34 @@
+import sys
+
+from backend.benchmark import generate_price_list
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Генерация прайс-листа в формате shop1.yaml заданного размера"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--categories", type=int, default=10)
+        parser.add_argument("--goods", type=int, default=1000)
+        parser.add_argument(
+            "--parameters", type=int, default=5, help="Параметров у товара"
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--format", choices=("yaml", "jsonl"), default="yaml")
+        parser.add_argument(
+            "-o", "--output", help="Файл прайс-листа, по умолчанию stdout"
+        )
+
+    def handle(self, *args, **options):
+        params = dict(
+            categories=options["categories"],
+            goods=options["goods"],
+            parameters=options["parameters"],
+            seed=options["seed"],
+            fmt=options["format"],
+        )
+        if not options["output"]:
+            generate_price_list(sys.stdout, **params)
+            return
+        with open(options["output"], "w", encoding="utf-8") as stream:
+            generate_price_list(stream, **params)
@@ -1,6 +1,7 @@
 from django.conf import settings
 from django.contrib.auth.base_user import BaseUserManager
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 from django_rest_passwordreset.tokens import get_token_generator
@@ -115,6 +116,21 @@ class Shop(models.Model):
         on_delete=models.CASCADE,
     )
     state = models.BooleanField(verbose_name="статус получения заказов", default=True)
+    source_etag = models.CharField(
+        verbose_name="ETag прайс-листа", max_length=255, blank=True
+    )
+    source_last_modified = models.CharField(
+        verbose_name="Last-Modified прайс-листа", max_length=64, blank=True
+    )
+    source_sha256 = models.CharField(
+        verbose_name="SHA-256 прайс-листа", max_length=64, blank=True
+    )
+    import_id = models.CharField(
+        verbose_name="Идентификатор текущего импорта", max_length=32, blank=True
+    )
+    import_started = models.DateTimeField(
+        verbose_name="Начало текущего импорта", null=True, blank=True
+    )
 
     class Meta:
         verbose_name = "Магазин"
@@ -154,6 +170,8 @@ class Product(models.Model):
         verbose_name = "Продукт"
         verbose_name_plural = "Список продуктов"
         ordering = ("-name",)
+        # поиск продуктов прайс-листа при импорте
+        indexes = [models.Index(fields=["name", "category"])]
 
     def __str__(self):
         return self.name
@@ -179,6 +197,70 @@ class ProductInfo(models.Model):
     quantity = models.PositiveIntegerField(verbose_name="Количество")
     price = models.PositiveIntegerField(verbose_name="Цена")
     price_rrc = models.PositiveIntegerField(verbose_name="Рекомендуемая розничная цена")
+    # предложение, пропавшее из прайс-листа, но попавшее в оформленные заказы,
+    # не удаляется вместе с позициями заказов, а снимается с продажи
+    is_active = models.BooleanField(verbose_name="В продаже", default=True)
+    # название продукта, модель и значения параметров, заполняются при импорте,
+    # GIN-индексы создаются после миграции (backend.signals)
+    search_text = models.TextField(
+        verbose_name="Текст для поиска", blank=True, default="", editable=False
+    )
+    search_vector = SearchVectorField(
+        verbose_name="Поисковый вектор", null=True, editable=False
+    )
+    # параметры для фильтров: {имя: значение} и {имя: число} для числовых
+    # значений, заполняются при импорте вместе с поисковым текстом
+    parameters = models.JSONField(
+        verbose_name="Параметры для фильтров", null=True, editable=False
+    )
+    numeric_parameters = models.JSONField(
+        verbose_name="Числовые параметры для фильтров", null=True, editable=False
+    )
+    # плоская модель чтения каталога: данные продукта, категории и магазина
+    # копируются в предложение, чтобы список товаров читался без соединений.
+    # Данные продукта и параметры обновляет импорт, данные магазина и
+    # категории - сигналы (backend.catalog)
+    product_name = models.CharField(
+        verbose_name="Название продукта",
+        max_length=60,
+        blank=True,
+        default="",
+        editable=False,
+    )
+    category = models.ForeignKey(
+        Category,
+        verbose_name="Категория",
+        related_name="+",
+        null=True,
+        blank=True,
+        editable=False,
+        on_delete=models.SET_NULL,
+    )
+    category_name = models.CharField(
+        verbose_name="Название категории",
+        max_length=40,
+        blank=True,
+        default="",
+        editable=False,
+    )
+    shop_name = models.CharField(
+        verbose_name="Название магазина",
+        max_length=50,
+        blank=True,
+        default="",
+        editable=False,
+    )
+    shop_state = models.BooleanField(
+        verbose_name="Статус получения заказов", default=False, editable=False
+    )
+    # [[min_sum, cost], ...] по возрастанию min_sum
+    shop_delivery = models.JSONField(
+        verbose_name="Доставка магазина", null=True, editable=False
+    )
+    # [[имя, значение], ...] в порядке параметров прайс-листа
+    parameter_list = models.JSONField(
+        verbose_name="Список параметров", null=True, editable=False
+    )
 
     class Meta:
         verbose_name = "Информация о продукте"
@@ -188,11 +270,61 @@ class ProductInfo(models.Model):
                 fields=["product", "shop", "external_id"], name="unique_product_info"
             ),
         ]
+        # сортировки каталога по цене: id различает равные цены, поэтому
+        # страница курсора читается по индексу без сортировки выборки.
+        # Индекс (product, price) не нужен: у продукта несколько предложений,
+        # их сортирует в памяти сам планировщик
+        indexes = [
+            models.Index(fields=["shop", "price", "id"], name="productinfo_shop_price"),
+            models.Index(fields=["price", "id"], name="productinfo_price"),
+        ]
 
     def __str__(self):
         return f"{self.product}"
 
 
+class StagedOffer(models.Model):
+    """
+    Предложение из части прайс-листа, ещё не перенесённое в каталог
+    """
+
+    import_id = models.CharField(
+        verbose_name="Идентификатор импорта", max_length=32, db_index=True
+    )
+    shop = models.ForeignKey(
+        Shop,
+        verbose_name="Магазин",
+        related_name="staged_offers",
+        on_delete=models.CASCADE,
+    )
+    product = models.ForeignKey(
+        Product,
+        verbose_name="Продукт",
+        related_name="staged_offers",
+        on_delete=models.CASCADE,
+    )
+    external_id = models.PositiveIntegerField(verbose_name="Внешний ИД")
+    model = models.CharField(max_length=60, verbose_name="Модель", blank=True)
+    quantity = models.PositiveIntegerField(verbose_name="Количество")
+    price = models.PositiveIntegerField(verbose_name="Цена")
+    price_rrc = models.PositiveIntegerField(verbose_name="Рекомендуемая розничная цена")
+    # [[ИД параметра, значение], ...] в порядке прайс-листа: по порядку
+    # вставки параметров строится parameter_list предложения
+    parameters = models.JSONField(verbose_name="Параметры", default=list)
+    # план изменений каталога, вычисляется при загрузке
+    offer_id = models.PositiveIntegerField(
+        verbose_name="ИД предложения в каталоге", null=True, blank=True
+    )
+    fields_changed = models.BooleanField(verbose_name="Изменены поля", default=False)
+    parameters_changed = models.BooleanField(
+        verbose_name="Изменены параметры", default=False
+    )
+
+    class Meta:
+        verbose_name = "Загружаемое предложение"
+        verbose_name_plural = "Список загружаемых предложений"
+
+
 class Parameter(models.Model):
     name = models.CharField(max_length=40, verbose_name="Название")
 
@@ -279,6 +411,7 @@ class Order(models.Model):
         on_delete=models.CASCADE,
     )
     dt = models.DateTimeField(verbose_name="Дата создания", auto_now_add=True)
+    updated = models.DateTimeField(verbose_name="Дата изменения", auto_now=True)
     state = models.CharField(
         verbose_name="Статус", choices=STATE_CHOICES, max_length=15
     )
@@ -0,0 +1,132 @@
+import json
+
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import CursorPagination, _reverse_ordering
+
+# значения параметра ordering: id различает равные значения и идёт в том же
+# направлении, чтобы сортировку по цене давал обход индекса (backend.models)
+PRODUCT_ORDERINGS = {
+    "price": ("price", "id"),
+    "-price": ("-price", "-id"),
+    "quantity": ("quantity", "id"),
+    "-quantity": ("-quantity", "-id"),
+}
+
+
+class ProductInfoPagination(CursorPagination):
+    """
+    Keyset pagination of offers: the cursor holds values of every ordering
+    column of the last row, so a page ordered by price is fetched with
+    WHERE price > cursor price OR (price = cursor price AND id > cursor id)
+    ORDER BY price, id LIMIT page_size, without OFFSET over equal prices.
+    The ordering query parameter sorts by price or quantity,
+    search results are sorted by rank.
+    """
+
+    ordering = "id"
+    page_size = settings.PRODUCTS_PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = settings.PRODUCTS_MAX_PAGE_SIZE
+
+    def get_ordering(self, request, queryset, view):
+        ordering = request.query_params.get("ordering")
+        if ordering:
+            if ordering not in PRODUCT_ORDERINGS:
+                raise ValidationError(
+                    {"ordering": f"Допустимые значения: {', '.join(PRODUCT_ORDERINGS)}"}
+                )
+            return PRODUCT_ORDERINGS[ordering]
+        # результаты поиска по релевантности, id различает равные ранги
+        if "rank" in queryset.query.annotations:
+            return ("-rank", "id")
+        return super().get_ordering(request, queryset, view)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # CursorPagination сравнивает с курсором только первую колонку
+        # сортировки и пропускает строки с равными значениями через OFFSET,
+        # здесь курсор сравнивается со всем ключом сортировки
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            offset, reverse, current_position = 0, False, None
+        else:
+            offset, reverse, current_position = self.cursor
+
+        if reverse:
+            queryset = queryset.order_by(*_reverse_ordering(self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        if current_position is not None:
+            queryset = queryset.filter(self.get_keyset_filter(current_position))
+
+        results = list(queryset[offset : offset + self.page_size + 1])
+        self.page = results[: self.page_size]
+        if len(results) > len(self.page):
+            following_position = self._get_position_from_instance(
+                results[-1], self.ordering
+            )
+        else:
+            following_position = None
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = current_position is not None or offset > 0
+            self.has_previous = following_position is not None
+            self.next_position = current_position
+            self.previous_position = following_position
+        else:
+            self.has_next = following_position is not None
+            self.has_previous = current_position is not None or offset > 0
+            self.next_position = following_position
+            self.previous_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def get_keyset_filter(self, position):
+        """
+        Rows after the position in the ordering of the cursor direction:
+        (a, b) > (x, y) is a > x OR (a = x AND b > y), every column
+        compared in its own direction
+        """
+
+        try:
+            values = json.loads(position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        # курсор другой сортировки или подделанный
+        if (
+            not isinstance(values, list)
+            or len(values) != len(self.ordering)
+            or not all(isinstance(value, (int, float)) for value in values)
+        ):
+            raise NotFound(self.invalid_cursor_message)
+
+        keyset, equal = Q(), {}
+        for order, value in zip(self.ordering, values):
+            column = order.lstrip("-")
+            lookup = "lt" if order.startswith("-") != self.cursor.reverse else "gt"
+            keyset |= Q(**equal, **{f"{column}__{lookup}": value})
+            equal[column] = value
+        return keyset
+
+    def _get_position_from_instance(self, instance, ordering):
+        # значения всех колонок сортировки, JSON сохраняет их типы
+        return json.dumps(
+            [
+                (
+                    instance[order.lstrip("-")]
+                    if isinstance(instance, dict)
+                    else getattr(instance, order.lstrip("-"))
+                )
+                for order in ordering
+            ]
+        )
@@ -0,0 +1,315 @@
+import json
+from functools import lru_cache
+
+from backend.models import (
+    Category,
+    Parameter,
+    Product,
+    ProductInfo,
+    ProductParameter,
+    StagedOffer,
+)
+from django.conf import settings
+from django.contrib.postgres.lookups import PostgresOperatorLookup
+from django.db import connection, connections
+from django.db.models import CharField, FloatField, Func, TextField, Value
+
+# символы, которые в текстовом формате COPY нужно экранировать
+COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+# числовые значения параметров, допустима десятичная запятая
+NUMBER_PATTERN = r"^-?\d+([.,]\d+)?$"
+
+
+def use_postgresql():
+    return connection.vendor == "postgresql"
+
+
+def use_copy():
+    """
+    COPY fast path is available on PostgreSQL only
+    """
+
+    return settings.IMPORT_USE_COPY and use_postgresql()
+
+
+@lru_cache(maxsize=None)
+def trigram_available():
+    """
+    pg_trgm may be unavailable on managed databases,
+    search works without trigrams then
+    """
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        return cursor.fetchone() is not None
+
+
+def create_catalog_indexes(using="default"):
+    """
+    Create pg_trgm extension and GIN indexes of the product search
+    and parameter filters after migrations. GinIndex with opclasses could
+    declare them in Meta, but the tests run on SQLite, which has no GIN
+    indexes, and migrations are not committed, so there is no migration
+    to create pg_trgm before gin_trgm_ops. Keep them out of Meta.
+    """
+
+    with connections[using].cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        if cursor.fetchone() is not None:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        trigram_available.cache_clear()
+
+        table = ProductInfo._meta.db_table
+        indexes = [
+            ("search_vector_gin", "search_vector"),
+            # @> для точных значений
+            ("parameters_gin", "parameters jsonb_path_ops"),
+            # ? для наличия числового параметра в диапазонных фильтрах
+            ("numeric_parameters_gin", "numeric_parameters"),
+        ]
+        if trigram_available():
+            indexes.append(("search_text_trgm", "search_text gin_trgm_ops"))
+        for name, columns in indexes:
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {table}_{name} "
+                f"ON {table} USING gin ({columns})"
+            )
+
+
+class TrigramWordSimilar(PostgresOperatorLookup):
+    """
+    Word similarity of the value to the text is above the threshold,
+    uses the trigram GIN index
+    """
+
+    lookup_name = "trigram_word_similar"
+    postgres_operator = "%%>"
+
+
+CharField.register_lookup(TrigramWordSimilar)
+TextField.register_lookup(TrigramWordSimilar)
+
+
+class TrigramWordSimilarity(Func):
+    function = "WORD_SIMILARITY"
+    output_field = FloatField()
+
+    def __init__(self, string, expression, **extra):
+        if not hasattr(string, "resolve_expression"):
+            string = Value(string)
+        super().__init__(string, expression, **extra)
+
+
+def update_offer_documents(offers):
+    """
+    Build search text and vector, filter parameters and product data
+    of the read model for the offers queryset with one statement
+    """
+
+    ids, params = offers.values("id").query.sql_with_params()
+    tables = dict(
+        offer=ProductInfo._meta.db_table,
+        product=Product._meta.db_table,
+        category=Category._meta.db_table,
+        parameter=ProductParameter._meta.db_table,
+        name=Parameter._meta.db_table,
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE {offer} AS offer
+            SET search_text = document.text,
+                search_vector = to_tsvector(%s::regconfig, document.text),
+                parameters = document.parameters,
+                numeric_parameters = document.numeric_parameters,
+                product_name = document.product_name,
+                category_id = document.category_id,
+                category_name = document.category_name,
+                parameter_list = document.parameter_list
+            FROM (
+                SELECT offer.id, concat_ws(
+                    ' ', product.name, NULLIF(offer.model, ''),
+                    string_agg(parameter.value, ' ' ORDER BY parameter.id)
+                ) AS text,
+                COALESCE(
+                    jsonb_object_agg(name.name, parameter.value)
+                    FILTER (WHERE parameter.id IS NOT NULL),
+                    '{{}}'
+                ) AS parameters,
+                COALESCE(
+                    jsonb_object_agg(
+                        name.name, replace(parameter.value, ',', '.')::float
+                    ) FILTER (WHERE parameter.value ~ %s),
+                    '{{}}'
+                ) AS numeric_parameters,
+                product.name AS product_name,
+                category.id AS category_id,
+                category.name AS category_name,
+                COALESCE(
+                    jsonb_agg(
+                        jsonb_build_array(name.name, parameter.value)
+                        ORDER BY parameter.id
+                    ) FILTER (WHERE parameter.id IS NOT NULL),
+                    '[]'
+                ) AS parameter_list
+                FROM {offer} AS offer
+                JOIN {product} AS product ON product.id = offer.product_id
+                JOIN {category} AS category ON category.id = product.category_id
+                LEFT JOIN {parameter} AS parameter
+                    ON parameter.product_info_id = offer.id
+                LEFT JOIN {name} AS name ON name.id = parameter.parameter_id
+                WHERE offer.id IN ({ids})
+                GROUP BY offer.id, product.id, category.id
+            ) AS document
+            WHERE offer.id = document.id
+            """.format(ids=ids, **tables),
+            [settings.SEARCH_CONFIG, NUMBER_PATTERN, *params],
+        )
+
+
+def parameter_facets(offers):
+    """
+    Count offers of the queryset by parameter values with one statement,
+    return (name, value, count) rows
+    """
+
+    ids, params = offers.order_by().values("id").query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT item.key, item.value, count(*)
+            FROM {offer} AS offer, jsonb_each_text(offer.parameters) AS item
+            WHERE offer.id IN ({ids})
+            GROUP BY item.key, item.value
+            """.format(ids=ids, offer=ProductInfo._meta.db_table),
+            params,
+        )
+        return cursor.fetchall()
+
+
+def copy_value(value):
+    """
+    Value in the text format of COPY
+    """
+
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value, ensure_ascii=False)
+    return str(value).translate(COPY_ESCAPES)
+
+
+class CopyStream:
+    """
+    File-like object reading COPY lines from an iterator,
+    so the rows are never kept in memory all together
+    """
+
+    def __init__(self, lines):
+        self.lines = iter(lines)
+        self.buffer = ""
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            line = next(self.lines, None)
+            if line is None:
+                break
+            self.buffer += line
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+
+def copy_objects(model, objects):
+    """
+    Insert model instances with COPY FROM STDIN, primary keys are not returned
+    """
+
+    fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+    columns = ", ".join(connection.ops.quote_name(field.column) for field in fields)
+    lines = (
+        "\t".join(copy_value(getattr(obj, field.attname)) for field in fields) + "\n"
+        for obj in objects
+    )
+    with connection.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY {connection.ops.quote_name(model._meta.db_table)} ({columns}) "
+            "FROM STDIN",
+            CopyStream(lines),
+        )
+
+
+def merge_staged_offers(import_id):
+    """
+    Apply the changes plan of staged offers to the catalog with set-based
+    statements. Vanished offers and parameters of changed offers must be
+    removed beforehand.
+    """
+
+    tables = dict(
+        staged=StagedOffer._meta.db_table,
+        offer=ProductInfo._meta.db_table,
+        parameter=ProductParameter._meta.db_table,
+    )
+    statements = (
+        # изменённые поля предложений
+        """
+        UPDATE {offer} AS offer
+        SET model = staged.model, price = staged.price,
+            price_rrc = staged.price_rrc, quantity = staged.quantity,
+            is_active = true
+        FROM {staged} AS staged
+        WHERE staged.import_id = %s AND staged.fields_changed
+            AND offer.id = staged.offer_id
+        """,
+        # изменённые параметры предложений, в порядке прайс-листа
+        """
+        INSERT INTO {parameter} (product_info_id, parameter_id, value)
+        SELECT staged.offer_id, (item.pair->>0)::integer, item.pair->>1
+        FROM {staged} AS staged,
+        jsonb_array_elements(staged.parameters)
+            WITH ORDINALITY AS item(pair, position)
+        WHERE staged.import_id = %s AND staged.parameters_changed
+            AND staged.offer_id IS NOT NULL
+        ORDER BY staged.id, item.position
+        ON CONFLICT DO NOTHING
+        """,
+        # новые предложения, из повторов в прайс-листе остаётся первое
+        """
+        INSERT INTO {offer} (
+            product_id, shop_id, external_id, model, price, price_rrc, quantity,
+            is_active, search_text, product_name, category_name, shop_name,
+            shop_state
+        )
+        SELECT product_id, shop_id, external_id, model, price, price_rrc, quantity,
+            true, '', '', '', '', false
+        FROM {staged}
+        WHERE import_id = %s AND offer_id IS NULL
+        ORDER BY id
+        ON CONFLICT DO NOTHING
+        """,
+        # параметры новых предложений, в порядке прайс-листа
+        """
+        INSERT INTO {parameter} (product_info_id, parameter_id, value)
+        SELECT offer.id, (item.pair->>0)::integer, item.pair->>1
+        FROM {staged} AS staged
+        JOIN {offer} AS offer ON offer.shop_id = staged.shop_id
+            AND offer.product_id = staged.product_id
+            AND offer.external_id = staged.external_id,
+        jsonb_array_elements(staged.parameters)
+            WITH ORDINALITY AS item(pair, position)
+        WHERE staged.import_id = %s AND staged.offer_id IS NULL
+        ORDER BY staged.id, item.position
+        ON CONFLICT DO NOTHING
+        """,
+    )
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement.format(**tables), [import_id])
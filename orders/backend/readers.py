@@ -0,0 +1,126 @@
+import json
+
+import yaml
+from yaml.events import (
+    AliasEvent,
+    MappingEndEvent,
+    MappingStartEvent,
+    ScalarEvent,
+    SequenceEndEvent,
+    SequenceStartEvent,
+)
+from yaml.nodes import MappingNode, ScalarNode, SequenceNode
+
+# C-загрузчик libyaml в разы быстрее, но может быть не собран
+Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+LIST_SECTIONS = ("categories", "goods")
+
+
+def read_price_list(stream, fmt=None):
+    """
+    Read price list record by record.
+
+    Yields (section, value) pairs: ("shop", name), ("categories", category)
+    and ("goods", item), so the whole document is never kept in memory.
+    Both YAML and JSON-lines are supported, JSON-lines is detected
+    by the leading "{" when fmt is not given.
+    """
+
+    if fmt is None:
+        fmt = "jsonl" if stream.read(1024).lstrip().startswith(b"{") else "yaml"
+        stream.seek(0)
+
+    if fmt == "jsonl":
+        return read_json_lines(stream)
+    return read_yaml(stream)
+
+
+def read_json_lines(stream):
+    """
+    Every line is a part of the shop1.yaml document, e.g.
+    {"shop": "Связной"}, {"categories": {"id": 1, "name": "..."}}
+    or {"goods": {"id": 4216292, "category": 224, ...}}
+    """
+
+    for line in stream:
+        if not line.strip():
+            continue
+        for section, value in json.loads(line).items():
+            if section in LIST_SECTIONS and isinstance(value, list):
+                for item in value:
+                    yield section, item
+            else:
+                yield section, value
+
+
+def read_yaml(stream):
+    loader = Loader(stream)
+    anchors = {}
+
+    def next_value():
+        return loader.construct_document(compose(loader, anchors))
+
+    try:
+        for event_class in (None, None, MappingStartEvent):
+            event = loader.get_event()
+            if event_class and not isinstance(event, event_class):
+                raise yaml.YAMLError("Прайс-лист должен быть словарём")
+
+        while not loader.check_event(MappingEndEvent):
+            section = next_value()
+            if section in LIST_SECTIONS and loader.check_event(SequenceStartEvent):
+                loader.get_event()
+                while not loader.check_event(SequenceEndEvent):
+                    yield section, next_value()
+                loader.get_event()
+            else:
+                yield section, next_value()
+    finally:
+        loader.dispose()
+
+
+def compose(loader, anchors):
+    """
+    Compose a node of the next value only, unlike yaml.compose
+    which builds the node tree of the whole document
+    """
+
+    event = loader.get_event()
+    if isinstance(event, AliasEvent):
+        if event.anchor not in anchors:
+            raise yaml.YAMLError(f"Неизвестный якорь {event.anchor}")
+        return anchors[event.anchor]
+
+    node = compose_value(loader, anchors, event)
+    if event.anchor is not None:
+        anchors[event.anchor] = node
+    return node
+
+
+def compose_value(loader, anchors, event):
+    tag = getattr(event, "tag", None)
+    if isinstance(event, ScalarEvent):
+        if tag is None or tag == "!":
+            tag = loader.resolve(ScalarNode, event.value, event.implicit)
+        return ScalarNode(tag, event.value, style=event.style)
+
+    if isinstance(event, SequenceStartEvent):
+        if tag is None or tag == "!":
+            tag = loader.resolve(SequenceNode, None, event.implicit)
+        items = []
+        while not loader.check_event(SequenceEndEvent):
+            items.append(compose(loader, anchors))
+        loader.get_event()
+        return SequenceNode(tag, items)
+
+    if isinstance(event, MappingStartEvent):
+        if tag is None or tag == "!":
+            tag = loader.resolve(MappingNode, None, event.implicit)
+        pairs = []
+        while not loader.check_event(MappingEndEvent):
+            pairs.append((compose(loader, anchors), compose(loader, anchors)))
+        loader.get_event()
+        return MappingNode(tag, pairs)
+
+    raise yaml.YAMLError(f"Неподдерживаемый элемент прайс-листа: {event}")
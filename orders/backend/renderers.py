@@ -0,0 +1,76 @@
+import csv
+import json
+
+from backend.serializers import render_fields
+from rest_framework.renderers import BaseRenderer
+
+
+class Echo:
+    """
+    File-like object returning written lines, for csv.writer
+    """
+
+    def write(self, value):
+        return value
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    One JSON object per line. stream() renders values() rows lazily
+    for a streaming response, render() is used for error responses.
+    """
+
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return self.line(data)
+
+    def stream(self, fields, rows):
+        for row in rows:
+            yield self.line(render_fields(fields, row))
+
+    @staticmethod
+    def line(data):
+        return json.dumps(data, ensure_ascii=False) + "\n"
+
+
+class CSVRenderer(BaseRenderer):
+    """
+    CSV with a header of dotted field names, lists are written as JSON.
+    stream() renders values() rows lazily for a streaming response,
+    render() is used for error responses.
+    """
+
+    media_type = "text/csv"
+    format = "csv"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        writer = csv.writer(Echo())
+        return writer.writerow(data.keys()) + writer.writerow(
+            map(self.cell, data.values())
+        )
+
+    def stream(self, fields, rows):
+        columns = [
+            (f"{name}.{subname}" if subname else name, column)
+            for name, node in fields.items()
+            for subname, column in (
+                node.items() if isinstance(node, dict) else [("", node)]
+            )
+        ]
+        writer = csv.writer(Echo())
+        # заголовок уходит клиенту до первого запроса к базе
+        yield writer.writerow(name for name, _ in columns)
+        for row in rows:
+            # вложенные объекты уже развёрнуты в колонки заголовка
+            data = render_fields(dict(columns), row)
+            yield writer.writerow(map(self.cell, data.values()))
+
+    @staticmethod
+    def cell(value):
+        if isinstance(value, (dict, list)):
+            return json.dumps(value, ensure_ascii=False)
+        return value
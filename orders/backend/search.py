@@ -0,0 +1,41 @@
+import re
+
+from backend.postgres import TrigramWordSimilarity, trigram_available, use_postgresql
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import F, FloatField, Q
+from django.db.models.functions import Cast
+
+
+def search_offers(queryset, text):
+    """
+    Filter offers by the search text and annotate them with relevance rank.
+
+    On PostgreSQL every word is searched as a prefix over search_vector
+    ("256" finds "256GB"), combined with trigram word similarity over
+    search_text for misspelled words. Other databases get a plain
+    case-insensitive match of every word without rank.
+    """
+
+    words = re.findall(r"\w+", text)
+    if not use_postgresql():
+        for word in words:
+            queryset = queryset.filter(search_text__icontains=word)
+        return queryset
+    if not words:
+        return queryset.none()
+
+    # в словах только буквы и цифры, спецсимволы tsquery в них не попадут
+    query = SearchQuery(
+        " & ".join(f"{word}:*" for word in words),
+        config=settings.SEARCH_CONFIG,
+        search_type="raw",
+    )
+    match = Q(search_vector=query)
+    rank = SearchRank(F("search_vector"), query)
+    if trigram_available():
+        match |= Q(search_text__trigram_word_similar=text)
+        rank = rank + TrigramWordSimilarity(text, "search_text")
+    # ts_rank возвращает real, а курсор сравнивает ранг с числом Python как
+    # double precision: без приведения равные ранги не равны значению курсора
+    return queryset.filter(match).annotate(rank=Cast(rank, FloatField()))
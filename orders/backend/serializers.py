@@ -1,3 +1,4 @@
+from backend.delivery import DeliveryTiers
 from backend.models import (
     Address,
     Category,
@@ -10,7 +11,7 @@ from backend.models import (
     Shop,
     User,
 )
-from django.db.models import F, Sum
+from django.db.models import Prefetch
 from drf_spectacular.utils import extend_schema_serializer
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
@@ -180,6 +181,128 @@ class ProductInfoSerializer(serializers.ModelSerializer):
         read_only_fields = ["id"]
 
 
+# дерево полей ответа ProductInfoSerializer: колонки модели чтения ProductInfo
+# или вложенные объекты
+PRODUCT_INFO_FIELDS = {
+    "id": "id",
+    "external_id": "external_id",
+    "model": "model",
+    "product": {"name": "product_name", "category": "category_name"},
+    "shop": {
+        "id": "shop_id",
+        "name": "shop_name",
+        "state": "shop_state",
+        "delivery": "shop_delivery",
+    },
+    "quantity": "quantity",
+    "price": "price",
+    "price_rrc": "price_rrc",
+    "product_parameters": "parameter_list",
+}
+
+# колонки идентификаторов свёрнутых вложенных объектов
+PRODUCT_INFO_RELATIONS = {"product": "product_id", "shop": "shop_id"}
+
+# колонки, которые хранятся компактнее, чем отдаются
+COLUMN_RENDERERS = {
+    "shop_delivery": lambda value: [
+        {"min_sum": min_sum, "cost": cost} for min_sum, cost in value or ()
+    ],
+    "parameter_list": lambda value: [
+        {"parameter": name, "value": parameter_value}
+        for name, parameter_value in value or ()
+    ],
+}
+
+
+def select_fields(fields=None, expand=None):
+    """
+    Prune PRODUCT_INFO_FIELDS by the fields and expand query parameters.
+
+    fields lists the response fields, "shop.id" selects a field of a nested
+    object. Without fields and expand the response is complete, with any of
+    them nested objects not in expand and not selected by subfields
+    are collapsed to their ids.
+    """
+
+    if fields is None and expand is None:
+        return PRODUCT_INFO_FIELDS
+    expand = set(expand or ())
+    unknown = expand - PRODUCT_INFO_RELATIONS.keys()
+    if unknown:
+        raise ValidationError({"expand": f"Неизвестные объекты: {', '.join(unknown)}"})
+
+    selected = {}
+    for path in PRODUCT_INFO_FIELDS if fields is None else fields:
+        name, _, subfield = path.partition(".")
+        node = PRODUCT_INFO_FIELDS.get(name)
+        if subfield:
+            node = node.get(subfield) if isinstance(node, dict) else None
+        if node is None:
+            raise ValidationError({"fields": f"Неизвестное поле '{path}'"})
+        if subfield:
+            if not isinstance(selected.get(name), dict):
+                selected[name] = {}
+            selected[name][subfield] = node
+        elif isinstance(node, dict) and name not in expand:
+            selected.setdefault(name, PRODUCT_INFO_RELATIONS[name])
+        else:
+            selected[name] = node
+    return selected
+
+
+def field_columns(fields):
+    """
+    values() columns of the fields tree, columns of cursor orderings
+    are always read
+    """
+
+    columns = dict.fromkeys(("id", "price", "quantity"))
+    for node in fields.values():
+        columns.update(
+            dict.fromkeys(node.values() if isinstance(node, dict) else [node])
+        )
+    return tuple(columns)
+
+
+def render_fields(fields, row):
+    result = {}
+    for name, node in fields.items():
+        if isinstance(node, dict):
+            result[name] = render_fields(node, row)
+        elif node in COLUMN_RENDERERS:
+            result[name] = COLUMN_RENDERERS[node](row[node])
+        else:
+            result[name] = row[node]
+    return result
+
+
+# колонки values() полного ответа ProductInfoValuesSerializer
+PRODUCT_INFO_VALUES = field_columns(PRODUCT_INFO_FIELDS)
+
+
+class ProductInfoValuesListSerializer(serializers.ListSerializer):
+    """
+    Build the ProductInfoSerializer JSON straight from values() rows
+    of the read model columns, without any other queries.
+    The fields tree of select_fields may be passed in the context.
+    """
+
+    def to_representation(self, data):
+        fields = self.context.get("fields", PRODUCT_INFO_FIELDS)
+        return [render_fields(fields, row) for row in data]
+
+
+class ProductInfoValuesSerializer(ProductInfoSerializer):
+    """
+    Read-only ProductInfoSerializer for lists of PRODUCT_INFO_VALUES rows,
+    without model instances and nested serializers. Use with many=True.
+    """
+
+    class Meta(ProductInfoSerializer.Meta):
+        list_serializer_class = ProductInfoValuesListSerializer
+
+
 @extend_schema_serializer(exclude_fields=["order"])
 class OrderItemSerializer(serializers.ModelSerializer):
     class Meta:
@@ -194,6 +317,24 @@ class OrderItemSerializer(serializers.ModelSerializer):
         extra_kwargs = {"order": {"write_only": True}}
 
 
+class BasketItemSerializer(serializers.Serializer):
+    """
+    Item of the basket add request, offers are checked by add_items
+    """
+
+    product_info = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=1)
+
+
+class BasketItemUpdateSerializer(serializers.Serializer):
+    """
+    Item of the basket update request, zero quantity deletes the line
+    """
+
+    id = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=0)
+
+
 class OrderProductInfoSerializer(ProductInfoSerializer):
     class Meta:
         model = ProductInfo
@@ -213,41 +354,57 @@ class ShopOrderItemSerializer(OrderItemSerializer):
     product_info = OrderProductInfoSerializer(read_only=True)
 
 
-class ShopOrderSerializer(serializers.ModelSerializer):
-    def __init__(self, *args, **kwargs):
-        # Don't pass the 'order_id' arg up to the superclass
-        order_id = kwargs.pop("order_id", None)
-
-        # Instantiate the superclass normally
-        super().__init__(*args, **kwargs)
-
-        self.order_id = order_id
+# всё, что выводит OrderSerializer, загружается этими запросами
+# для любого числа заказов и позиций
+ORDER_ITEMS_PREFETCH = (
+    Prefetch(
+        "ordered_items",
+        queryset=OrderItem.objects.select_related(
+            "product_info__shop", "product_info__product__category"
+        ),
+    ),
+    Prefetch(
+        "ordered_items__product_info__product_parameters",
+        queryset=ProductParameter.objects.select_related("parameter"),
+    ),
+    "ordered_items__product_info__shop__delivery",
+)
 
-    shop_sum = serializers.IntegerField()
 
-    class Meta:
-        model = Shop
-        fields = [
-            "id",
-            "name",
-            "shop_sum",
-        ]
-        read_only_fields = ["id"]
-
-    def to_representation(self, instance):
-        ret = super().to_representation(instance)
-        if self.order_id is not None:
-            ordered_items = OrderItem.objects.filter(
-                product_info__shop=instance.id, order=self.order_id
-            )
-            ret["ordered_items"] = [
-                ShopOrderItemSerializer(item).data for item in ordered_items
-            ]
-
-        return ret
+def group_order_items(items):
+    """
+    Group order items by shop, count shop sums and resolve delivery costs
+    from the prefetched tiers, items must be fetched with ORDER_ITEMS_PREFETCH.
+    Return shop dicts with the delivery cost or the delivery error.
+    """
+
+    shop_items = {}
+    for item in items:
+        shop_items.setdefault(item.product_info.shop_id, []).append(item)
+
+    tiers = DeliveryTiers(
+        (shop_id, delivery.min_sum, delivery.cost)
+        for shop_id, items in shop_items.items()
+        for delivery in items[0].product_info.shop.delivery.all()
+    )
+    groups = []
+    for shop_id in sorted(shop_items):
+        items = sorted(shop_items[shop_id], key=lambda item: item.id)
+        shop = items[0].product_info.shop
+        shop_sum = sum(item.quantity * item.product_info.price for item in items)
+        cost, error = tiers.resolve(shop_id, shop_sum)
+        groups.append(
+            dict(shop=shop, items=items, shop_sum=shop_sum, cost=cost, error=error)
+        )
+    return groups
 
 
 class OrderSerializer(serializers.ModelSerializer):
+    """
+    Order with its items grouped by shop and delivery costs,
+    orders must be fetched with ORDER_ITEMS_PREFETCH
+    """
+
     total_sum = serializers.IntegerField()
     address = AddressSerializer(read_only=True)
 
@@ -260,38 +417,22 @@ class OrderSerializer(serializers.ModelSerializer):
         ret = super().to_representation(instance)
         delivery_costs = []
         invalid_deliveries = []
-        shops = (
-            Shop.objects.filter(product_infos__ordered_items__order=instance.id)
-            .annotate(
-                shop_sum=Sum(
-                    F("product_infos__ordered_items__quantity")
-                    * F("product_infos__price")
-                )
-            )
-            .distinct()
-        )
         ret["shops"] = []
-        for shop in shops:
-            shop_data = ShopOrderSerializer(shop, order_id=instance.id).data
-            shop_deliveries = Delivery.objects.filter(shop=shop)
-            if shop_deliveries:
-                shop_delivery = (
-                    shop_deliveries.filter(min_sum__lte=shop_data["shop_sum"])
-                    .order_by("-min_sum")
-                    .first()
-                )
-                if shop_delivery is None:
-                    shop_data["delivery"] = (
-                        f"{shop_data['name']}: " f"сумма заказа меньше минимальной."
-                    )
-                    invalid_deliveries.append(shop_data["delivery"])
-                else:
-                    shop_data["delivery"] = shop_delivery.cost
-                    delivery_costs.append(shop_data["delivery"])
+        for group in group_order_items(instance.ordered_items.all()):
+            shop = group["shop"]
+            shop_data = {
+                "id": shop.id,
+                "name": shop.name,
+                "shop_sum": group["shop_sum"],
+                "ordered_items": ShopOrderItemSerializer(
+                    group["items"], many=True
+                ).data,
+            }
+            if group["error"] is None:
+                shop_data["delivery"] = group["cost"]
+                delivery_costs.append(shop_data["delivery"])
             else:
-                shop_data["delivery"] = (
-                    f"{shop_data['name']}: " f"стоимость доставки недоступна."
-                )
+                shop_data["delivery"] = f"{shop.name}: {group['error']}"
                 invalid_deliveries.append(shop_data["delivery"])
             ret["shops"].append(shop_data)
 
@@ -1,6 +1,14 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models.signals import post_delete, post_migrate, post_save
 from django.dispatch import receiver
+from django.utils import timezone
 from django_rest_passwordreset.signals import reset_password_token_created
 
+from .cache import bump_catalog_version
+from .catalog import backfill_catalog, refresh_category, refresh_shops
+from .models import Address, Category, Delivery, Order, Shop
+from .postgres import create_catalog_indexes
 from .tasks import send_email_task
 
 
@@ -24,3 +32,47 @@ def password_reset_token_created(sender, instance, reset_password_token, **kwarg
         # to:
         [reset_password_token.user.email],
     )
+
+
+@receiver([post_save, post_delete], sender=Shop)
+def shop_changed(sender, instance, signal, **kwargs):
+    # в том числе сохранение магазина в конце импорта прайс-листа,
+    # новые предложения получают данные магазина здесь
+    if signal is post_save:
+        refresh_shops([instance.id])
+    bump_catalog_version([instance.id])
+
+
+@receiver([post_save, post_delete], sender=Delivery)
+def delivery_changed(sender, instance, **kwargs):
+    refresh_shops([instance.shop_id])
+    bump_catalog_version([instance.shop_id])
+
+
+@receiver([post_save, post_delete], sender=Category)
+def category_changed(sender, instance, signal, **kwargs):
+    if signal is post_save:
+        refresh_category(instance)
+    bump_catalog_version()
+
+
+@receiver(post_save, sender=Address)
+def address_changed(sender, instance, **kwargs):
+    # адрес входит в ответ со списком заказов, а ETag списка строится
+    # по отметкам изменения заказов
+    Order.objects.filter(address=instance).update(updated=timezone.now())
+
+
+@receiver(post_migrate)
+def catalog_indexes(sender, using, **kwargs):
+    if sender.name == "backend" and connections[using].vendor == "postgresql":
+        create_catalog_indexes(using)
+
+
+@receiver(post_migrate)
+def catalog_backfill(sender, using, **kwargs):
+    # после добавления колонок модели чтения каталог пуст, пока магазины
+    # не обновят прайс-листы, поэтому заполняем её при развёртывании
+    if sender.name == "backend" and using == DEFAULT_DB_ALIAS:
+        if backfill_catalog(settings.IMPORT_BATCH_SIZE):
+            bump_catalog_version()
@@ -1,13 +1,16 @@
-from backend.models import (
-    Category,
-    Parameter,
-    Product,
-    ProductInfo,
-    ProductParameter,
-    Shop,
+from backend.fetchers import fetch_price_lists
+from backend.importer import (
+    PriceListImporter,
+    acquire_import_lock,
+    discard_import,
+    load_price_list,
+    price_list_sha256,
+    remove_price_list,
 )
-from celery import shared_task
+from backend.models import Shop
+from celery import chord, shared_task
 from django.conf import settings
+from django.core.files.storage import default_storage
 from django.core.mail import EmailMultiAlternatives
 
 
@@ -18,39 +21,147 @@ def send_email_task(title, message, addressee_list, sender=settings.EMAIL_HOST_U
     msg.send()
 
 
-@shared_task()
-def do_import_task(shop_id, data):
+@shared_task(bind=True)
+def do_import_task(
+    self,
+    shop_id,
+    source,
+    incremental=None,
+    etag="",
+    last_modified="",
+    force=False,
+    partitioned=None,
+):
+    # source - имя файла прайс-листа в хранилище, а не сами данные,
+    # чтобы не передавать весь каталог через брокер
     shop = Shop.objects.get(id=shop_id)
+    import_id = acquire_import_lock(shop.id)
+    if import_id is None:
+        # магазин уже импортируется, повторяем после завершения
+        raise self.retry(countdown=settings.IMPORT_LOCK_RETRY_DELAY, max_retries=None)
 
-    for category in data["categories"]:
-        category_object, _ = Category.objects.get_or_create(
-            id=category["id"], name=category["name"]
-        )
-        category_object.shops.add(shop.id)
-        category_object.save()
-    ProductInfo.objects.filter(shop_id=shop.id).delete()
-    for item in data["goods"]:
-        product, _ = Product.objects.get_or_create(
-            name=item["name"], category_id=item["category"]
-        )
+    if partitioned is None:
+        partitioned = settings.IMPORT_PARTITIONED
+    dispatched = False
+    try:
+        shop.refresh_from_db()
+        sha256 = price_list_sha256(source)
+        if sha256 == shop.source_sha256 and not force:
+            # прайс-лист не изменился с последнего импорта
+            Shop.objects.filter(id=shop.id).update(is_uptodate=True)
+            return {"skipped": True}
 
-        product_info = ProductInfo.objects.create(
-            product_id=product.id,
-            external_id=item["id"],
-            model=item["model"],
-            price=item["price"],
-            price_rrc=item["price_rrc"],
-            quantity=item["quantity"],
-            shop_id=shop.id,
+        shop.source_sha256 = sha256
+        shop.source_etag = etag
+        shop.source_last_modified = last_modified
+        importer = PriceListImporter(shop, incremental=incremental)
+        if not partitioned:
+            return importer.run(load_price_list(source), import_id)
+
+        chunks = importer.split(load_price_list(source), import_id)
+        finalize = finalize_import_task.si(
+            shop.id,
+            import_id,
+            incremental,
+            shop.name,
+            sha256,
+            etag,
+            last_modified,
         )
-        for name, value in item["parameters"].items():
-            parameter_object, _ = Parameter.objects.get_or_create(name=name)
-            ProductParameter.objects.create(
-                product_info_id=product_info.id,
-                parameter_id=parameter_object.id,
-                value=value,
+        if chunks:
+            chord(
+                import_chunk_task.si(shop.id, import_id, chunk, incremental)
+                for chunk in chunks
+            )(finalize.on_error(discard_import_task.si(shop.id, import_id)))
+        else:
+            finalize.delay()
+        dispatched = True
+        return {"import_id": import_id, "chunks": len(chunks)}
+    finally:
+        if not dispatched:
+            discard_import(shop.id, import_id)
+        # данные импорта уже в каталоге или в частях, скачанный файл не нужен
+        remove_price_list(source)
+
+
+@shared_task()
+def import_chunk_task(shop_id, import_id, chunk, incremental=None):
+    shop = Shop.objects.get(id=shop_id)
+    importer = PriceListImporter(shop, incremental=incremental)
+    importer.stage(load_price_list(chunk), import_id)
+    default_storage.delete(chunk)
+
+
+@shared_task()
+def finalize_import_task(
+    shop_id, import_id, incremental, name, sha256, etag, last_modified
+):
+    """
+    Merge staged chunks into the catalog, remove stale offers
+    and mark the shop as up to date
+    """
+
+    try:
+        shop = Shop.objects.get(id=shop_id)
+        if shop.import_id != import_id:
+            # блокировка истекла и перехвачена, загруженные части удалены
+            return {"discarded": True}
+        shop.name = name
+        shop.source_sha256 = sha256
+        shop.source_etag = etag
+        shop.source_last_modified = last_modified
+        return PriceListImporter(shop, incremental=incremental).merge_staged(import_id)
+    finally:
+        discard_import(shop_id, import_id)
+
+
+@shared_task()
+def discard_import_task(shop_id, import_id):
+    discard_import(shop_id, import_id)
+
+
+@shared_task()
+def update_price_lists_task(shop_ids):
+    """
+    Fetch price lists of the shops concurrently and start their import
+    """
+
+    updating, not_updated, already_updated = [], dict(), []
+    to_fetch = []
+    for shop in Shop.objects.filter(id__in=shop_ids):
+        if shop.is_uptodate:
+            already_updated.append(shop.name)
+        elif shop.file:
+            do_import_task.delay(shop.id, shop.file.name)
+            updating.append(shop.name)
+        elif shop.url:
+            to_fetch.append(shop)
+        else:
+            not_updated[shop.name] = "Нет файла для актуализации"
+
+    not_modified_ids = []
+    for shop, result in zip(to_fetch, fetch_price_lists(to_fetch)):
+        if result.error:
+            not_updated[shop.name] = result.error
+        elif result.not_modified:
+            not_modified_ids.append(shop.id)
+            already_updated.append(shop.name)
+            if result.etag or result.last_modified:
+                # содержимое не изменилось, но сервер выдал новые валидаторы,
+                # со старыми условные запросы больше не сработают
+                Shop.objects.filter(id=shop.id).update(
+                    source_etag=result.etag, source_last_modified=result.last_modified
+                )
+        else:
+            do_import_task.delay(
+                shop.id,
+                result.source,
+                etag=result.etag,
+                last_modified=result.last_modified,
             )
+            updating.append(shop.name)
+    Shop.objects.filter(id__in=not_modified_ids).update(is_uptodate=True)
 
-    shop.name = data["shop"]
-    shop.is_uptodate = True
-    shop.save()
+    return dict(
+        updating=updating, not_updated=not_updated, already_updated=already_updated
+    )
@@ -1,11 +1,75 @@
+import csv
+import hashlib
+import io
+import json
 import os
+import threading
+from datetime import timedelta
 
 import pytest
-from backend.models import User
+import requests
+import yaml
+from backend.basket import reserve_stock
+from backend.benchmark import (
+    compare_results,
+    format_table,
+    generate_price_list,
+    measure,
+    reset_peak_rss,
+    run_benchmark,
+)
+from backend.catalog import refresh_offers, refresh_shops
+from backend.delivery import DeliveryTiers
+from backend.importer import (
+    PriceListImporter,
+    acquire_import_lock,
+    load_price_list,
+    save_price_list,
+)
+from backend.models import (
+    Address,
+    Category,
+    Delivery,
+    Order,
+    OrderItem,
+    Parameter,
+    Product,
+    ProductInfo,
+    ProductParameter,
+    Shop,
+    StagedOffer,
+    User,
+)
+from backend.postgres import copy_value
+from backend.readers import read_price_list
+from backend.serializers import (
+    PRODUCT_INFO_VALUES,
+    ProductInfoSerializer,
+    ProductInfoValuesSerializer,
+)
+from backend.signals import catalog_backfill
+from backend.tasks import (
+    do_import_task,
+    finalize_import_task,
+    update_price_lists_task,
+)
+from celery.exceptions import Retry
+from django.apps import apps
 from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from requests.adapters import BaseAdapter
+from requests.models import Response
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
 from rest_framework.test import APIClient
 
+from orders import celery_app
+
 PATH_PREFIX = "http://127.0.0.1:8000/api/v1/"
 
 
@@ -141,3 +205,1240 @@ class TestPartner:
             )
 
         assert response.status_code == expected_status, description
+
+
+def backend_queries(context):
+    # без запросов профилировщика silk, который записывает каждый запрос в базу
+    return [
+        query["sql"]
+        for query in context.captured_queries
+        if "backend_" in query["sql"]
+        and "silk_" not in query["sql"]
+        and not query["sql"].startswith("EXPLAIN")
+    ]
+
+
+def price_list_source(price_list):
+    return save_price_list(
+        yaml.safe_dump(price_list, allow_unicode=True, sort_keys=False).encode()
+    )
+
+
+class StubAdapter(BaseAdapter):
+    """
+    Transport adapter answering with prepared (status, headers, body)
+    responses by url and recording the requests
+    """
+
+    def __init__(self, responses):
+        super().__init__()
+        self.responses = responses
+        self.requests = {}
+
+    def send(self, request, **kwargs):
+        self.requests[request.url] = request
+        status_code, headers, body = self.responses[request.url]
+        response = Response()
+        response.status_code = status_code
+        response.headers.update(headers)
+        response._content = body
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+@pytest.mark.django_db
+class TestImport:
+    @pytest.fixture(autouse=True)
+    def media_root(self, settings, tmp_path):
+        settings.MEDIA_ROOT = tmp_path
+
+    @pytest.fixture
+    def price_list(self):
+        with open(valid_update_data["file"], "rb") as fp:
+            return yaml.safe_load(fp)
+
+    @pytest.fixture
+    def shop(self):
+        return Shop.objects.create(name="Магазин")
+
+    def test_import(self, shop, price_list):
+        do_import_task(shop.id, price_list_source(price_list))
+
+        shop.refresh_from_db()
+        assert shop.name == price_list["shop"]
+        assert shop.is_uptodate
+        assert ProductInfo.objects.filter(shop=shop).count() == len(price_list["goods"])
+        assert ProductParameter.objects.filter(product_info__shop=shop).count() == sum(
+            len(item["parameters"]) for item in price_list["goods"]
+        )
+
+    def test_import_json_lines(self, shop, price_list):
+        lines = [{"shop": price_list["shop"]}] + [
+            {section: item}
+            for section in ("categories", "goods")
+            for item in price_list[section]
+        ]
+        source = save_price_list(
+            "\n".join(json.dumps(line, ensure_ascii=False) for line in lines).encode()
+        )
+
+        do_import_task(shop.id, source)
+
+        assert ProductInfo.objects.filter(shop=shop).count() == len(price_list["goods"])
+        assert ProductParameter.objects.filter(product_info__shop=shop).count() == sum(
+            len(item["parameters"]) for item in price_list["goods"]
+        )
+
+    def test_update_price_lists(self, settings, shop, price_list):
+        settings.PRICE_LIST_FETCH_RETRIES = 0
+        shop.file.save("shop1.yaml", ContentFile(yaml.safe_dump(price_list).encode()))
+        unreachable = Shop.objects.create(name="Недоступный", url="http://127.0.0.1:9/")
+        empty = Shop.objects.create(name="Без прайс-листа")
+        uptodate = Shop.objects.create(name="Актуальный", is_uptodate=True)
+
+        result = update_price_lists_task(
+            [shop.id, unreachable.id, empty.id, uptodate.id]
+        )
+
+        assert result == {
+            "updating": [shop.name],
+            "not_updated": {
+                unreachable.name: "Нет соединения",
+                empty.name: "Нет файла для актуализации",
+            },
+            "already_updated": [uptodate.name],
+        }
+
+    def test_update_price_lists_conditional(self, monkeypatch, price_list):
+        content = yaml.safe_dump(price_list, allow_unicode=True).encode()
+        sha256 = hashlib.sha256(content).hexdigest()
+        validators = dict(
+            source_etag='"v1"',
+            source_last_modified="Wed, 01 Jan 2025 00:00:00 GMT",
+            source_sha256=sha256,
+        )
+        # 304, тот же прайс-лист с новым ETag и новый прайс-лист
+        not_modified, same, changed = [
+            Shop.objects.create(name=name, url=f"http://example.com/{name}", **data)
+            for name, data in (("a", validators), ("b", validators), ("c", {}))
+        ]
+        adapter = StubAdapter(
+            {
+                not_modified.url: (304, {}, b""),
+                same.url: (200, {"ETag": '"v2"'}, content),
+                changed.url: (200, {"ETag": '"v3"'}, content),
+            }
+        )
+        session = requests.Session()
+        session.mount("http://", adapter)
+        monkeypatch.setattr("backend.fetchers.make_session", lambda: session)
+        calls = []
+        monkeypatch.setattr(
+            do_import_task,
+            "delay",
+            lambda *args, **kwargs: calls.append((args, kwargs)),
+        )
+
+        result = update_price_lists_task([not_modified.id, same.id, changed.id])
+
+        headers = adapter.requests[not_modified.url].headers
+        assert headers["If-None-Match"] == validators["source_etag"]
+        assert headers["If-Modified-Since"] == validators["source_last_modified"]
+        assert "If-None-Match" not in adapter.requests[changed.url].headers
+        assert result["updating"] == [changed.name]
+        assert sorted(result["already_updated"]) == [not_modified.name, same.name]
+        # импорт запущен только для изменённого прайс-листа
+        assert [(args[0], kwargs["etag"]) for args, kwargs in calls] == [
+            (changed.id, '"v3"')
+        ]
+        for shop in (not_modified, same, changed):
+            shop.refresh_from_db()
+        assert not_modified.is_uptodate and same.is_uptodate
+        assert not_modified.source_etag == '"v1"'
+        assert same.source_etag == '"v2"'
+        # валидаторы сохраняются только после успешного импорта
+        assert not changed.is_uptodate and changed.source_etag == ""
+
+        failed = dict(calls[0][1], etag='"broken"')
+        with pytest.raises(KeyError):
+            do_import_task(changed.id, save_price_list(b"goods: [{}]"), **failed)
+        changed.refresh_from_db()
+        assert changed.source_etag == "" and changed.source_sha256 == ""
+
+        do_import_task(*calls[0][0], **calls[0][1])
+        changed.refresh_from_db()
+        assert changed.is_uptodate
+        assert changed.source_etag == '"v3"'
+        assert changed.source_sha256 == sha256
+
+    def test_reimport(self, shop, price_list):
+        do_import_task(shop.id, price_list_source(price_list))
+        report = do_import_task(shop.id, price_list_source(price_list), force=True)
+
+        assert report["inserted"] == 0
+        assert ProductInfo.objects.filter(shop=shop).count() == len(price_list["goods"])
+
+    def test_reimport_unchanged(self, shop, price_list):
+        do_import_task(shop.id, price_list_source(price_list))
+        Shop.objects.filter(id=shop.id).update(is_uptodate=False)
+
+        source = price_list_source(price_list)
+        assert do_import_task(shop.id, source) == {"skipped": True}
+        shop.refresh_from_db()
+        assert shop.is_uptodate
+        # скачанный прайс-лист удаляется и после пропуска импорта
+        assert not default_storage.exists(source)
+
+    def test_import_removes_price_list(self, shop, price_list):
+        sources = [price_list_source(price_list) for _ in range(2)]
+        assert sources[0] != sources[1]
+        shop.file.save("shop1.yaml", ContentFile(yaml.safe_dump(price_list).encode()))
+
+        do_import_task(shop.id, sources[0])
+        do_import_task(shop.id, shop.file.name, force=True)
+
+        assert not default_storage.exists(sources[0])
+        # вторая загрузка того же прайс-листа не затронута
+        assert default_storage.exists(sources[1])
+        assert default_storage.exists(shop.file.name)
+
+    def test_incremental_import(self, shop, price_list):
+        do_import_task(shop.id, price_list_source(price_list))
+        kept = ProductInfo.objects.get(external_id=price_list["goods"][0]["id"])
+
+        removed, changed = price_list["goods"].pop(), price_list["goods"][1]
+        changed["price"] += 100
+        price_list["goods"].append({**changed, "id": 1, "parameters": {}})
+        report = do_import_task(
+            shop.id, price_list_source(price_list), incremental=True
+        )
+
+        assert report == {
+            "inserted": 1,
+            "updated": 1,
+            "unchanged": len(price_list["goods"]) - 2,
+            "removed": 1,
+        }
+        assert ProductInfo.objects.filter(id=kept.id).exists()
+        assert not ProductInfo.objects.filter(external_id=removed["id"]).exists()
+        assert (
+            ProductInfo.objects.get(external_id=changed["id"]).price == changed["price"]
+        )
+
+    @pytest.mark.parametrize("incremental", [False, True])
+    def test_import_keeps_order_items(self, shop, price_list, incremental):
+        do_import_task(shop.id, price_list_source(price_list))
+        user = User.objects.create_user("buyer@example.com")
+        vanished = price_list["goods"].pop()
+        offer = ProductInfo.objects.get(shop=shop, external_id=vanished["id"])
+        for state in ("delivered", "basket"):
+            order = Order.objects.create(user=user, state=state)
+            OrderItem.objects.create(order=order, product_info=offer, quantity=1)
+
+        report = do_import_task(
+            shop.id, price_list_source(price_list), incremental=incremental
+        )
+
+        assert report["removed"] == 1
+        # позиция оформленного заказа осталась, предложение снято с продажи
+        assert OrderItem.objects.filter(order__state="delivered").count() == 1
+        offer.refresh_from_db()
+        assert not offer.is_active
+        assert offer.quantity == 0
+
+        price_list["goods"].append(vanished)
+        report = do_import_task(
+            shop.id, price_list_source(price_list), incremental=incremental
+        )
+        assert report["removed"] == 0
+        offer.refresh_from_db()
+        assert offer.is_active
+        assert offer.quantity == vanished["quantity"]
+        assert ProductInfo.objects.filter(shop=shop).count() == len(price_list["goods"])
+
+    @pytest.mark.parametrize("incremental", [False, True])
+    def test_partitioned_import(
+        self, settings, monkeypatch, shop, price_list, incremental
+    ):
+        monkeypatch.setattr(celery_app.conf, "task_always_eager", True)
+        settings.IMPORT_CHUNK_SIZE = 2
+        do_import_task(shop.id, price_list_source(price_list))
+        price_list["goods"][0]["price"] += 100
+        price_list["goods"].pop()
+
+        do_import_task(
+            shop.id,
+            price_list_source(price_list),
+            incremental=incremental,
+            partitioned=True,
+        )
+
+        shop.refresh_from_db()
+        assert shop.is_uptodate
+        assert not shop.import_id
+        assert not StagedOffer.objects.exists()
+        assert sorted(
+            ProductInfo.objects.filter(shop=shop).values_list("external_id", "price")
+        ) == sorted((item["id"], item["price"]) for item in price_list["goods"])
+
+    def test_staged_offers_are_invisible(self, shop, price_list):
+        do_import_task(shop.id, price_list_source(price_list))
+        catalog = set(ProductInfo.objects.values_list("id", "price"))
+        price_list["goods"][0]["price"] += 100
+        price_list["goods"].pop()
+        importer = PriceListImporter(shop, incremental=True)
+
+        importer.stage(load_price_list(price_list_source(price_list)), "import")
+
+        assert set(ProductInfo.objects.values_list("id", "price")) == catalog
+        report = importer.merge_staged("import")
+        assert report == {
+            "inserted": 0,
+            "updated": 1,
+            "unchanged": len(price_list["goods"]) - 1,
+            "removed": 1,
+        }
+        assert not StagedOffer.objects.exists()
+
+    @pytest.mark.parametrize("use_copy", [False, True])
+    def test_import_use_copy(self, settings, shop, price_list, use_copy):
+        settings.IMPORT_USE_COPY = use_copy
+        do_import_task(shop.id, price_list_source(price_list))
+        changed = price_list["goods"][0]
+        changed["model"] = "a\\b\tc\nd"
+        changed["parameters"] = {"Цвет": "чёрный\\белый"}
+        price_list["goods"].append({**changed, "id": 1})
+
+        do_import_task(shop.id, price_list_source(price_list), incremental=True)
+
+        offers = ProductInfo.objects.filter(shop=shop)
+        assert sorted(offers.values_list("external_id", "model", "price")) == sorted(
+            (item["id"], item["model"], item["price"]) for item in price_list["goods"]
+        )
+        for external_id in (changed["id"], 1):
+            parameters = ProductParameter.objects.filter(
+                product_info__shop=shop, product_info__external_id=external_id
+            ).values_list("parameter__name", "value")
+            assert dict(parameters) == changed["parameters"]
+
+    @pytest.mark.parametrize("use_copy", [False, True])
+    def test_import_parameter_order(self, settings, shop, price_list, use_copy):
+        settings.IMPORT_USE_COPY = use_copy
+        # ИД параметров идут не в порядке прайс-листа и не в порядке ключей jsonb
+        names = [f"Параметр {number}" for number in range(12)]
+        Parameter.objects.bulk_create(Parameter(name=name) for name in names)
+        item = price_list["goods"][0]
+        values = {name: str(number) for number, name in enumerate(names)}
+
+        for order in (names[::-1], names):
+            item["parameters"] = {name: values[name] for name in order}
+            do_import_task(shop.id, price_list_source(price_list), incremental=True)
+
+            offer = ProductInfo.objects.get(shop=shop, external_id=item["id"])
+            assert offer.parameter_list == [[name, values[name]] for name in order]
+
+    def test_import_locked(self, shop, price_list):
+        acquire_import_lock(shop.id)
+
+        with pytest.raises(Retry):
+            do_import_task(shop.id, price_list_source(price_list))
+        assert not ProductInfo.objects.filter(shop=shop).exists()
+
+    def test_import_stale_lock(self, settings, shop, price_list):
+        do_import_task(shop.id, price_list_source(price_list))
+        offers = ProductInfo.objects.filter(shop=shop).count()
+        # рабочий процесс упал между загрузкой частей и слиянием
+        stale_id = acquire_import_lock(shop.id)
+        PriceListImporter(shop).stage(
+            load_price_list(price_list_source(price_list)), stale_id
+        )
+        chunk = default_storage.save(
+            f"price_lists/chunks/{stale_id}/0.jsonl", ContentFile(b"")
+        )
+        assert acquire_import_lock(shop.id) is None
+
+        Shop.objects.filter(id=shop.id).update(
+            import_started=timezone.now()
+            - timedelta(seconds=settings.IMPORT_LOCK_TIMEOUT + 1)
+        )
+        import_id = acquire_import_lock(shop.id)
+        assert import_id not in (None, stale_id)
+        assert not StagedOffer.objects.exists()
+        assert not default_storage.exists(chunk)
+
+        # запоздавшее слияние прерванного импорта не применяет пустой план
+        report = finalize_import_task(shop.id, stale_id, None, shop.name, "", "", "")
+        assert report == {"discarded": True}
+        assert ProductInfo.objects.filter(shop=shop).count() == offers
+        assert Shop.objects.get(id=shop.id).import_id == import_id
+
+    def test_import_failed(self, monkeypatch, shop, price_list):
+        def merge_staged(importer, import_id):
+            raise RuntimeError("слияние прервано")
+
+        monkeypatch.setattr(PriceListImporter, "merge_staged", merge_staged)
+        with pytest.raises(RuntimeError):
+            do_import_task(shop.id, price_list_source(price_list))
+
+        assert not StagedOffer.objects.exists()
+        assert not Shop.objects.get(id=shop.id).import_id
+
+    @pytest.mark.parametrize(
+        "value,expected",
+        [
+            (None, "\\N"),
+            (True, "t"),
+            (42, "42"),
+            ("a\tb\\c\n", "a\\tb\\\\c\\n"),
+            ({"1": "Да"}, '{"1": "Да"}'),
+        ],
+    )
+    def test_copy_value(self, value, expected):
+        assert copy_value(value) == expected
+
+    @pytest.mark.parametrize("incremental", [False, True])
+    def test_import_query_count(self, price_list, incremental):
+        def count_queries(copies):
+            shop = Shop.objects.create(name=f"Магазин {copies}")
+            goods = [
+                {**item, "name": f"{item['name']} {copies}", "id": item["id"] + i}
+                for i in range(copies)
+                for item in price_list["goods"]
+            ]
+            source = price_list_source({**price_list, "goods": goods})
+            with CaptureQueriesContext(connection) as context:
+                do_import_task(shop.id, source, incremental)
+            return len(context)
+
+        count_queries(1)  # создаём категории и параметры
+        assert count_queries(5) == count_queries(10)
+
+    @pytest.mark.parametrize("fmt", ["yaml", "jsonl"])
+    def test_generate_price_list(self, fmt):
+        stream = io.StringIO()
+        generate_price_list(stream, categories=3, goods=20, parameters=4, fmt=fmt)
+
+        records = list(read_price_list(io.BytesIO(stream.getvalue().encode())))
+        goods = [value for section, value in records if section == "goods"]
+        assert len([section for section, _ in records if section == "categories"]) == 3
+        assert len(goods) == 20
+        assert all(len(item["parameters"]) == 4 for item in goods)
+
+    def test_benchmark(self):
+        results = run_benchmark([5, 10])
+
+        assert [(row["goods"], row["scenario"]) for row in results] == [
+            (5, "import"),
+            (5, "reimport"),
+            (10, "import"),
+            (10, "reimport"),
+        ]
+        baseline = [{**row, "queries": row["queries"] - 1} for row in results]
+        assert compare_results(results, baseline, tolerance=10) == results
+        assert "Δ запросов" in format_table(results)
+
+    def test_measure_peak_rss(self):
+        if not reset_peak_rss():
+            pytest.skip("Пик RSS сбрасывается только в Linux")
+
+        large = measure(lambda: bytearray(200 * 2**20))
+        small = measure(lambda: None)
+
+        # пик каждого замера свой, а не максимум за всё время процесса
+        assert large["rss"] - small["rss"] > 150
+
+
+@pytest.mark.django_db
+class TestCatalog:
+    @pytest.fixture(autouse=True)
+    def clear_cache(self):
+        cache.clear()
+
+    @pytest.fixture
+    def api_client(self):
+        return APIClient()
+
+    @pytest.fixture
+    def shop(self, settings, tmp_path):
+        settings.MEDIA_ROOT = tmp_path
+        shop = Shop.objects.create(name="Магазин")
+        with open(valid_update_data["file"], "rb") as fp:
+            do_import_task(shop.id, save_price_list(fp.read()))
+        return shop
+
+    def test_products_pages(self, api_client, shop):
+        ids, queries = [], []
+        url = full_path("products/?page_size=3")
+        while url:
+            with CaptureQueriesContext(connection) as context:
+                response = api_client.get(url)
+            assert response.status_code == status.HTTP_200_OK
+            ids += [item["id"] for item in response.data["results"]]
+            queries.append(len(context))
+            url = response.data["next"]
+
+        assert ids == sorted(
+            ProductInfo.objects.filter(shop=shop).values_list("id", flat=True)
+        )
+        # глубокие страницы стоят столько же, сколько первая
+        assert len(set(queries[:-1])) == 1
+
+    @pytest.mark.parametrize(
+        "params", [{"shop_id": "²"}, {"shop_id": "abc"}, {"category_id": "٣"}]
+    )
+    def test_products_invalid_ids(self, api_client, shop, params):
+        response = api_client.get(full_path("products/"), params)
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_products_invalid_cursor(self, api_client, shop):
+        response = api_client.get(full_path("products/?cursor=invalid"))
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    @pytest.mark.parametrize(
+        "path", ["categories/", "shops/", "products/", "products/?shop_id={shop}"]
+    )
+    def test_catalog_cache(self, api_client, shop, path):
+        url = full_path(path.format(shop=shop.id))
+        response = api_client.get(url)
+
+        with CaptureQueriesContext(connection) as context:
+            cached = api_client.get(url)
+        assert not backend_queries(context)
+        assert cached.data == response.data
+
+    def test_catalog_cache_invalidation(
+        self, api_client, shop, django_capture_on_commit_callbacks
+    ):
+        products = full_path(f"products/?shop_id={shop.id}")
+        shops = full_path("shops/")
+        api_client.get(products), api_client.get(shops)
+        with open(valid_update_data["file"], "rb") as fp:
+            price_list = yaml.safe_load(fp)
+        price_list["goods"][0]["price"] += 100
+
+        with django_capture_on_commit_callbacks(execute=True):
+            Delivery.objects.create(shop=shop, min_sum=0, cost=300)
+            do_import_task(shop.id, price_list_source(price_list))
+
+        assert api_client.get(shops).data[0]["delivery"][0]["cost"] == 300
+        prices = {
+            item["external_id"]: item["price"]
+            for item in api_client.get(products).data["results"]
+        }
+        assert prices[price_list["goods"][0]["id"]] == price_list["goods"][0]["price"]
+
+    def test_catalog_cache_host(self, api_client, shop, settings):
+        settings.ALLOWED_HOSTS = ["one.example.com", "two.example.com"]
+        url = full_path("products/?page_size=1")
+
+        response = api_client.get(url, HTTP_HOST="one.example.com")
+        assert response.data["next"].startswith("http://one.example.com/")
+        response = api_client.get(url, HTTP_HOST="two.example.com")
+        assert response.data["next"].startswith("http://two.example.com/")
+        response = api_client.get(url, HTTP_HOST="two.example.com", secure=True)
+        assert response.data["next"].startswith("https://two.example.com/")
+
+    def test_catalog_etag(self, api_client, shop, django_capture_on_commit_callbacks):
+        url = full_path("categories/")
+        etag = api_client.get(url)["ETag"]
+
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        assert response["ETag"] == etag
+
+        with django_capture_on_commit_callbacks(execute=True):
+            Category.objects.create(id=100500, name="Новая категория")
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_200_OK
+        assert response["ETag"] != etag
+
+    def test_basket_etag(self, api_client, shop):
+        api_client.force_authenticate(User.objects.create_user("buyer@example.com"))
+        url = full_path("basket/")
+        etag = api_client.get(url)["ETag"]
+
+        with CaptureQueriesContext(connection) as context:
+            response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        # только отметки изменения заказов, без сериализации корзины
+        assert len(backend_queries(context)) == 1
+
+        offer = ProductInfo.objects.filter(shop=shop).first()
+        api_client.post(url, {"items": [{"product_info": offer.id, "quantity": 1}]})
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data[0]["shops"][0]["ordered_items"]
+
+    def test_orders_etag_address(self, api_client, shop):
+        user = User.objects.create_user("buyer@example.com")
+        api_client.force_authenticate(user)
+        address = Address.objects.create(user=user, city="Москва", street="Тверская")
+        Order.objects.create(user=user, state="new", address=address)
+        url = full_path("order/")
+        etag = api_client.get(url)["ETag"]
+        assert api_client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == (
+            status.HTTP_304_NOT_MODIFIED
+        )
+
+        response = api_client.patch(
+            full_path(f"user/addresses/{address.id}/"), {"city": "Казань"}
+        )
+        assert response.status_code == status.HTTP_200_OK
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_200_OK
+        assert response["ETag"] != etag
+        assert "Казань" in json.dumps(response.data, ensure_ascii=False)
+
+    def test_basket_add(self, api_client, shop):
+        user = User.objects.create_user("buyer@example.com")
+        api_client.force_authenticate(user)
+        url = full_path("basket/")
+        offers = list(ProductInfo.objects.filter(shop=shop).order_by("id"))
+        ProductInfo.objects.filter(shop=shop).update(quantity=1000)
+        items = [{"product_info": offer.id, "quantity": 1} for offer in offers]
+        api_client.post(url, {"items": items[:1]})
+
+        queries = []
+        for count in (2, len(offers)):
+            with CaptureQueriesContext(connection) as context:
+                response = api_client.post(url, {"items": items[:count]})
+            assert response.status_code == status.HTTP_200_OK
+            queries.append(len(backend_queries(context)))
+        # число запросов не зависит от числа позиций
+        assert queries[0] == queries[1], queries
+        assert response.json()["Создано объектов"] == len(offers) - 2
+        assert response.json()["Обновлено объектов"] == 2
+
+        # повтор товара в запросе складывается с позицией корзины
+        response = api_client.post(url, {"items": [items[0], items[0]]})
+        assert response.json()["Обновлено объектов"] == 1
+        assert OrderItem.objects.get(product_info=offers[0]).quantity == 5
+
+    def test_basket_add_invalid(self, api_client, shop):
+        api_client.force_authenticate(User.objects.create_user("buyer@example.com"))
+        url = full_path("basket/")
+        offer, other = ProductInfo.objects.filter(shop=shop).order_by("id")[:2]
+        item = {"product_info": offer.id, "quantity": 1}
+
+        for items in (
+            [item, {"product_info": 100500, "quantity": 1}],
+            [item, {"product_info": other.id, "quantity": other.quantity + 1}],
+            [item, {"product_info": other.id, "quantity": 0}],
+        ):
+            response = api_client.post(url, {"items": items})
+            assert response.status_code == status.HTTP_400_BAD_REQUEST
+        Shop.objects.filter(id=shop.id).update(state=False)
+        response = api_client.post(url, {"items": [item]})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        # корзина не заполняется частично
+        assert not OrderItem.objects.exists()
+
+    def test_basket_update(self, api_client, shop):
+        user = User.objects.create_user("buyer@example.com")
+        api_client.force_authenticate(user)
+        url = full_path("basket/")
+        basket = Order.objects.create(user=user, state="basket")
+        OrderItem.objects.bulk_create(
+            [
+                OrderItem(order=basket, product_info=offer, quantity=1)
+                for offer in ProductInfo.objects.filter(shop=shop).order_by("id")
+            ]
+        )
+        ids = sorted(OrderItem.objects.values_list("id", flat=True))
+        items = [{"id": ids[0], "quantity": 0}, {"id": 100500, "quantity": 1}] + [
+            {"id": line_id, "quantity": 2} for line_id in ids[1:]
+        ]
+
+        with CaptureQueriesContext(connection) as context:
+            response = api_client.put(url, {"items": items})
+        assert response.status_code == status.HTTP_200_OK
+        data = response.json()
+        assert data["Обновлённые позиции"] == ids[1:]
+        assert data["Удалённые позиции"] == ids[:1]
+        assert data["Не найденные позиции"] == [100500]
+        assert set(OrderItem.objects.values_list("quantity", flat=True)) == {2}
+        # одно чтение позиций, один UPDATE и один DELETE при любом числе позиций
+        statements = [
+            sql.split()[0] for sql in backend_queries(context) if "orderitem" in sql
+        ]
+        assert statements == ["SELECT", "UPDATE", "DELETE"], statements
+
+        available = ProductInfo.objects.get(ordered_items__id=ids[1]).quantity
+        response = api_client.put(
+            url, {"items": [{"id": ids[1], "quantity": available + 1}]}
+        )
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        # в ошибке номера позиций корзины, а не предложений
+        assert response.json()["Errors"]["quantity"] == (
+            f"Недостаточно товара в наличии для позиций: {[ids[1]]}"
+        )
+        response = api_client.put(url, {"items": [{"id": ids[0], "quantity": 1}]})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.json()["Не найденные позиции"] == ids[:1]
+
+    def test_delivery_tiers(self):
+        tiers = DeliveryTiers([(1, 5000, 0), (1, 0, 300), (1, 1000, 100), (2, 500, 50)])
+
+        assert tiers.resolve(1, 0) == (300, None)
+        assert tiers.resolve(1, 999) == (300, None)
+        assert tiers.resolve(1, 1000) == (100, None)
+        assert tiers.resolve(1, 100500) == (0, None)
+        assert tiers.resolve(2, 499)[0] is None
+        assert tiers.resolve(3, 1000)[0] is None
+
+    def test_checkout_delivery(self, api_client, shop):
+        user = User.objects.create_user("buyer@example.com")
+        api_client.force_authenticate(user)
+        basket = Order.objects.create(user=user, state="basket")
+        offers = ProductInfo.objects.filter(shop=shop)
+        OrderItem.objects.bulk_create(
+            [
+                OrderItem(order=basket, product_info=offer, quantity=1)
+                for offer in offers
+            ]
+        )
+        shop_sum = sum(offer.price for offer in offers)
+        shop.refresh_from_db()
+        url = full_path("order/")
+
+        response = api_client.post(url)
+        assert response.json()["Errors"] == [
+            f"{shop.name}: стоимость доставки недоступна."
+        ]
+        Delivery.objects.create(shop=shop, min_sum=shop_sum + 1, cost=0)
+        response = api_client.post(url)
+        assert response.json()["Errors"] == [
+            f"{shop.name}: сумма заказа меньше минимальной."
+        ]
+        Delivery.objects.create(shop=shop, min_sum=0, cost=300)
+        with CaptureQueriesContext(connection) as context:
+            response = api_client.post(url)
+        # доставка проверена, дальше не хватает адреса
+        assert response.json()["Errors"] == "Не указаны все необходимые аргументы"
+        # корзина, позиции с магазинами и пороги доставки
+        assert len(backend_queries(context)) == 3
+
+    def test_checkout_stock(self, api_client, shop):
+        user = User.objects.create_user("buyer@example.com")
+        api_client.force_authenticate(user)
+        Delivery.objects.create(shop=shop, min_sum=0, cost=300)
+        offer, other = ProductInfo.objects.filter(shop=shop).order_by("id")[:2]
+        basket = Order.objects.create(user=user, state="basket")
+        OrderItem.objects.bulk_create(
+            [
+                OrderItem(order=basket, product_info=offer, quantity=offer.quantity),
+                OrderItem(
+                    order=basket, product_info=other, quantity=other.quantity + 1
+                ),
+            ]
+        )
+
+        response = api_client.post(full_path("order/"), {"address_id": 100500})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.json()["Errors"]["quantity"] == [
+            f"{other.id}: заказано {other.quantity + 1}, в наличии {other.quantity}"
+        ]
+        # ничего не зарезервировано
+        assert ProductInfo.objects.get(id=offer.id).quantity == offer.quantity
+        assert Order.objects.get(id=basket.id).state == "basket"
+
+        OrderItem.objects.filter(product_info=other).update(quantity=1)
+        reserve_stock(basket)
+        assert ProductInfo.objects.get(id=offer.id).quantity == 0
+        assert ProductInfo.objects.get(id=other.id).quantity == other.quantity - 1
+
+    @pytest.mark.django_db(transaction=True)
+    def test_checkout_stock_concurrent(self, shop):
+        if connection.vendor != "postgresql":
+            pytest.skip("SQLite блокирует базу целиком, нужны блокировки строк")
+        stock, buyers = 5, 20
+        offers = list(ProductInfo.objects.filter(shop=shop).order_by("id")[:2])
+        ProductInfo.objects.filter(id__in=[offer.id for offer in offers]).update(
+            quantity=stock
+        )
+        orders = []
+        for number in range(buyers):
+            user = User.objects.create_user(f"buyer{number}@example.com")
+            order = Order.objects.create(user=user, state="basket")
+            # горячие товары в разном порядке в корзинах
+            for offer in offers[:: 1 if number % 2 else -1]:
+                OrderItem.objects.create(order=order, product_info=offer, quantity=1)
+            orders.append(order)
+
+        barrier = threading.Barrier(buyers)
+        results = []
+
+        def checkout(order):
+            try:
+                barrier.wait()
+                reserve_stock(order)
+            except ValidationError:
+                results.append(False)
+            else:
+                results.append(True)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout, args=(order,)) for order in orders]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(results) == buyers
+        assert results.count(True) == stock
+        assert set(
+            ProductInfo.objects.filter(
+                id__in=[offer.id for offer in offers]
+            ).values_list("quantity", flat=True)
+        ) == {0}
+
+    @pytest.mark.django_db(transaction=True)
+    def test_checkout_double_submit(self, shop):
+        if connection.vendor != "postgresql":
+            pytest.skip("SQLite блокирует базу целиком, нужны блокировки строк")
+        submits = 5
+        Delivery.objects.create(shop=shop, min_sum=0, cost=300)
+        user = User.objects.create_user("buyer@example.com")
+        address = Address.objects.create(user=user, city="Москва", street="Тверская")
+        basket = Order.objects.create(user=user, state="basket")
+        offers = list(ProductInfo.objects.filter(shop=shop).order_by("id")[:2])
+        for offer in offers:
+            OrderItem.objects.create(order=basket, product_info=offer, quantity=1)
+
+        barrier = threading.Barrier(submits)
+        results = []
+
+        def checkout():
+            try:
+                client = APIClient()
+                client.force_authenticate(user)
+                barrier.wait()
+                response = client.post(
+                    full_path("order/"), {"address_id": address.id}, format="json"
+                )
+                results.append(response.status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout) for _ in range(submits)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # заказ оформлен один раз, повторные отправки корзину уже не находят
+        assert sorted(results) == [status.HTTP_200_OK] + [
+            status.HTTP_400_BAD_REQUEST
+        ] * (submits - 1)
+        assert Order.objects.get(id=basket.id).state == "new"
+        for offer in offers:
+            assert ProductInfo.objects.get(id=offer.id).quantity == offer.quantity - 1
+
+    @pytest.mark.parametrize("path", ["order/", "basket/"])
+    def test_orders_query_count(self, api_client, shop, path):
+        user = User.objects.create_user("buyer@example.com")
+        api_client.force_authenticate(user)
+        Delivery.objects.create(shop=shop, min_sum=0, cost=500)
+        other = Shop.objects.create(name="Другой магазин")
+        offers = list(ProductInfo.objects.filter(shop=shop)) + [
+            ProductInfo.objects.create(
+                product=offer.product,
+                shop=other,
+                external_id=offer.external_id,
+                quantity=10,
+                price=offer.price,
+                price_rrc=offer.price_rrc,
+            )
+            for offer in ProductInfo.objects.filter(shop=shop)[:2]
+        ]
+        state = "basket" if path == "basket/" else "new"
+
+        queries = []
+        for number in range(1, 6):
+            if state == "new" or number == 1:
+                order = Order.objects.create(user=user, state=state)
+            OrderItem.objects.bulk_create(
+                [
+                    OrderItem(order=order, product_info=offer, quantity=number)
+                    for offer in offers[:number]
+                ],
+                ignore_conflicts=True,
+            )
+            with CaptureQueriesContext(connection) as context:
+                response = api_client.get(full_path(path))
+            queries.append(len(backend_queries(context)))
+
+        assert response.status_code == status.HTTP_200_OK
+        assert max(len(order["shops"]) for order in response.data) == 2
+        # число запросов не зависит от числа заказов, магазинов и позиций
+        assert len(set(queries)) == 1, queries
+
+    def test_product_info_values_serializer(self, shop):
+        other = Shop.objects.create(name="Другой магазин", state=False)
+        Delivery.objects.create(shop=shop, min_sum=1000, cost=0)
+        Delivery.objects.create(shop=shop, min_sum=0, cost=300)
+        offer = ProductInfo.objects.filter(shop=shop).first()
+        ProductInfo.objects.create(
+            product=offer.product,
+            shop=other,
+            external_id=1,
+            quantity=1,
+            price=1,
+            price_rrc=1,
+        )
+        refresh_offers(ProductInfo.objects.filter(shop=other), batch_size=10)
+        refresh_shops([other.id])
+        offers = ProductInfo.objects.order_by("id")
+
+        expected = ProductInfoSerializer(
+            offers.prefetch_related("product_parameters"), many=True
+        ).data
+        data = ProductInfoValuesSerializer(
+            offers.values(*PRODUCT_INFO_VALUES), many=True
+        ).data
+        assert json.loads(json.dumps(data)) == json.loads(json.dumps(expected))
+
+    def test_products_read_model(
+        self, api_client, shop, django_capture_on_commit_callbacks
+    ):
+        category = Category.objects.get(id=224)
+        category.name = "Телефоны"
+        category.save()
+        Delivery.objects.create(shop=shop, min_sum=0, cost=300)
+
+        with CaptureQueriesContext(connection) as context:
+            response = api_client.get(full_path("products/"))
+        queries = backend_queries(context)
+        # страница читается одним запросом к таблице предложений
+        assert len(queries) == 1
+        assert "JOIN" not in queries[0]
+        item = response.data["results"][0]
+        assert item["product"]["category"] == "Телефоны"
+        assert item["shop"]["delivery"] == [{"min_sum": 0, "cost": 300}]
+
+        shop.state = False
+        with django_capture_on_commit_callbacks(execute=True):
+            shop.save()
+        response = api_client.get(full_path("products/"))
+        assert response.data["results"] == []
+
+    def test_catalog_backfill(
+        self, api_client, shop, django_capture_on_commit_callbacks
+    ):
+        offers = ProductInfo.objects.order_by("id")
+        fields = (*PRODUCT_INFO_VALUES, "search_text", "parameters", "shop_delivery")
+        expected = list(offers.values(*fields))
+        # колонки модели чтения сразу после миграции, которая их добавила
+        offers.update(
+            search_text="",
+            search_vector=None,
+            parameters=None,
+            numeric_parameters=None,
+            parameter_list=None,
+            product_name="",
+            category=None,
+            category_name="",
+            shop_name="",
+            shop_state=False,
+            shop_delivery=None,
+        )
+        assert api_client.get(full_path("products/")).data["results"] == []
+
+        with django_capture_on_commit_callbacks(execute=True):
+            catalog_backfill(apps.get_app_config("backend"), "default")
+        assert list(offers.values(*fields)) == expected
+        assert api_client.get(full_path("products/")).data["results"]
+
+    @pytest.mark.parametrize(
+        "params, expected",
+        [
+            (
+                {"fields": "external_id,price,quantity,shop"},
+                lambda shop: {
+                    "external_id": 4216292,
+                    "price": 110000,
+                    "quantity": 14,
+                    "shop": shop.id,
+                },
+            ),
+            (
+                {"fields": "external_id,shop.id"},
+                lambda shop: {"external_id": 4216292, "shop": {"id": shop.id}},
+            ),
+            (
+                {"fields": "product", "expand": "product"},
+                lambda shop: {
+                    "product": {
+                        "name": "Смартфон Apple iPhone XS Max 512GB (золотистый)",
+                        "category": "Смартфоны",
+                    }
+                },
+            ),
+        ],
+    )
+    def test_products_fields(self, api_client, shop, params, expected):
+        with CaptureQueriesContext(connection) as context:
+            response = api_client.get(full_path("products/"), params)
+
+        assert response.data["results"][0] == expected(shop)
+        # невыбранные колонки не читаются
+        assert "parameter_list" not in backend_queries(context)[0]
+
+    @pytest.mark.parametrize(
+        "params", [{"fields": "id,shop.city"}, {"fields": "id.id"}, {"expand": "user"}]
+    )
+    def test_products_invalid_fields(self, api_client, shop, params):
+        response = api_client.get(full_path("products/"), params)
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    @pytest.mark.parametrize(
+        "ordering, key",
+        [
+            ("price", lambda item: (item["price"], item["id"])),
+            ("-price", lambda item: (-item["price"], -item["id"])),
+            ("-quantity", lambda item: (-item["quantity"], -item["id"])),
+        ],
+    )
+    def test_products_ordering(self, api_client, shop, ordering, key):
+        items = []
+        url = full_path(f"products/?page_size=1&ordering={ordering}")
+        while url:
+            response = api_client.get(url)
+            items += response.data["results"]
+            url = response.data["next"]
+
+        assert len(items) == ProductInfo.objects.filter(shop=shop).count()
+        assert items == sorted(items, key=key)
+
+    @pytest.mark.parametrize(
+        "params, reverse",
+        [
+            ({"ordering": "price"}, False),
+            ({"ordering": "-price"}, True),
+            ({"search": "Apple iPhone"}, False),
+        ],
+    )
+    def test_products_cursor_ties(self, api_client, shop, params, reverse):
+        # у всех предложений одна цена: курсор различает их по id
+        ProductInfo.objects.filter(shop=shop).update(price=1000)
+        ids = sorted(
+            ProductInfo.objects.filter(shop=shop).values_list("id", flat=True),
+            reverse=reverse,
+        )
+
+        def walk(url, data, link):
+            pages, queries = [], []
+            while url:
+                with CaptureQueriesContext(connection) as context:
+                    response = api_client.get(url, data)
+                assert response.status_code == status.HTTP_200_OK
+                pages.append([item["id"] for item in response.data["results"]])
+                queries += backend_queries(context)
+                url, data = response.data[link], None
+            assert not [sql for sql in queries if "OFFSET" in sql]
+            return pages, response
+
+        pages, response = walk(
+            full_path("products/"), {**params, "page_size": 2}, "next"
+        )
+        found = [offer_id for page in pages for offer_id in page]
+        if "search" in params:
+            assert sorted(found) == sorted(ids)
+        else:
+            assert found == ids
+        # обратно по ссылкам previous те же страницы
+        back, _ = walk(response.data["previous"], None, "previous")
+        assert back == pages[-2::-1]
+
+    @pytest.mark.parametrize(
+        "params, expected",
+        [
+            ({"price_min": 65000}, [4216226, 4216292, 4216313]),
+            ({"price_min": 61000, "price_max": 65000}, [4216226, 4216313]),
+            ({"in_stock": "true"}, [4216226, 4216292, 4216313, 4672670]),
+        ],
+    )
+    def test_products_price_filters(self, api_client, shop, params, expected):
+        response = api_client.get(full_path("products/"), params)
+
+        assert (
+            sorted(item["external_id"] for item in response.data["results"]) == expected
+        )
+
+    @pytest.mark.parametrize(
+        "params",
+        [
+            {"ordering": "name"},
+            {"price_min": "дёшево"},
+            {"price_max": "-1"},
+            {"price_min": "²"},
+        ],
+    )
+    def test_products_invalid_ordering_filters(self, api_client, shop, params):
+        response = api_client.get(full_path("products/"), params)
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    @pytest.mark.parametrize(
+        "filters, ordering, index",
+        [
+            ("shop", ("price", "id"), "productinfo_shop_price"),
+            ("shop", ("-price", "-id"), "productinfo_shop_price"),
+            (None, ("price", "id"), "productinfo_price"),
+        ],
+    )
+    def test_products_ordering_plan(self, filters, ordering, index):
+        # планировщику нужен каталог заметного размера и его статистика
+        category = Category.objects.create(id=1, name="Категория")
+        Product.objects.bulk_create(
+            [
+                Product(name=f"Товар {number}", category=category)
+                for number in range(200)
+            ]
+        )
+        products = list(Product.objects.filter(category=category))
+        shops = [Shop.objects.create(name=f"Магазин {number}") for number in range(5)]
+        ProductInfo.objects.bulk_create(
+            [
+                ProductInfo(
+                    product=product,
+                    shop=shop,
+                    external_id=product.id,
+                    quantity=1,
+                    price=(product.id * 7919 + shop.id * 104729) % 100000,
+                    price_rrc=100000,
+                    shop_state=True,
+                )
+                for product in products
+                for shop in shops
+            ]
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+        offer = ProductInfo.objects.first()
+        queryset = ProductInfo.objects.filter(shop_state=True, price__gte=1000)
+        if filters:
+            queryset = queryset.filter(**{filters: getattr(offer, filters)})
+
+        # не через QuerySet.explain(): silk перехватывает запросы ORM
+        # и дописывает к ним свой EXPLAIN
+        sql, params = queryset.order_by(*ordering)[:50].query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f"{connection.ops.explain_query_prefix()} {sql}", params)
+            plan = "\n".join(map(str, cursor.fetchall()))
+
+        assert index in plan
+
+    def test_products_export_ndjson(self, api_client, shop, settings):
+        settings.PRODUCTS_EXPORT_CHUNK_SIZE = 3
+        expected = api_client.get(full_path("products/")).data["results"]
+
+        response = api_client.get(full_path("products/export/"))
+
+        assert response.streaming
+        assert response["Content-Type"] == "application/x-ndjson; charset=utf-8"
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        assert [json.loads(line) for line in lines] == json.loads(json.dumps(expected))
+
+    def test_products_export_csv(self, api_client, shop):
+        response = api_client.get(
+            full_path("products/export/"),
+            {"format": "csv", "fields": "external_id,shop.name,product_parameters"},
+        )
+
+        assert response.streaming
+        content = b"".join(response.streaming_content).decode()
+        rows = list(csv.reader(io.StringIO(content)))
+        assert rows[0] == ["external_id", "shop.name", "product_parameters"]
+        assert len(rows) == 1 + ProductInfo.objects.filter(shop=shop).count()
+        assert rows[1][:2] == ["4216292", "Связной"]
+        assert {"parameter": "Диагональ (дюйм)", "value": "6.5"} in json.loads(
+            rows[1][2]
+        )
+
+    def test_products_export_invalid_fields(self, api_client, shop):
+        response = api_client.get(full_path("products/export/"), {"fields": "city"})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    @pytest.mark.parametrize(
+        "search, expected",
+        [
+            # у XR 128GB параметр "Встроенная память (Гб)" тоже 256
+            ("iPhone XR 256", ["XR 256GB", "XR 256GB", "XR 128GB"]),
+            ("xr 256gb", ["XR 256GB", "XR 256GB"]),
+            ("Galaxy", []),
+        ],
+    )
+    def test_products_search(self, api_client, shop, search, expected):
+        response = api_client.get(full_path("products/"), {"search": search})
+
+        names = [item["product"]["name"] for item in response.data["results"]]
+        assert sorted(name.split(" iPhone ")[1][:8] for name in names) == sorted(
+            expected
+        )
+
+    @pytest.mark.parametrize(
+        "params, expected",
+        [
+            ({"parameter": "Встроенная память (Гб):512"}, [4216292]),
+            ({"parameter": ["Цвет:красный", "Цвет:черный"]}, [4216226, 4216313]),
+            (
+                {"parameter": ["Цвет:синий", "Встроенная память (Гб):256"]},
+                [4672670],
+            ),
+            ({"parameter_min": "Диагональ (дюйм):6.2"}, [4216292]),
+            (
+                {"parameter_max": "Диагональ (дюйм):6,1"},
+                [4216226, 4216313, 4672670],
+            ),
+            ({"parameter_min": "Цвет:1"}, []),
+        ],
+    )
+    def test_products_parameter_filters(self, api_client, shop, params, expected):
+        response = api_client.get(full_path("products/"), params)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert (
+            sorted(item["external_id"] for item in response.data["results"]) == expected
+        )
+
+    @pytest.mark.parametrize(
+        "params",
+        [
+            {"parameter": "Цвет"},
+            {"parameter_min": "Диагональ (дюйм):шесть"},
+        ],
+    )
+    def test_products_invalid_parameter_filters(self, api_client, shop, params):
+        response = api_client.get(full_path("products/"), params)
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_products_facets(self, api_client, shop):
+        params = {"parameter": "Встроенная память (Гб):256"}
+        queries = []
+        for facets in ("false", "true"):
+            with CaptureQueriesContext(connection) as context:
+                response = api_client.get(
+                    full_path("products/"), {**params, "facets": facets}
+                )
+            queries.append(len(backend_queries(context)))
+
+        assert response.data["facets"] == {
+            "Встроенная память (Гб)": {"256": 3},
+            "Диагональ (дюйм)": {"6.1": 3},
+            "Разрешение (пикс)": {"1792x828": 3},
+            "Цвет": {"красный": 1, "синий": 1, "черный": 1},
+        }
+        # счётчики всех параметров - одним запросом
+        assert queries[1] - queries[0] == 1
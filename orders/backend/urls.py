@@ -11,6 +11,7 @@ from .views import (
     CategoryView,
     OrderView,
     PartnerViewSet,
+    ProductExportView,
     ProductInfoView,
     ShopView,
     UserViewSet,
@@ -32,6 +33,7 @@ urlpatterns = [
     path("categories/", CategoryView.as_view(), name="categories"),
     path("shops/", ShopView.as_view(), name="shops"),
     path("products/", ProductInfoView.as_view(), name="products"),
+    path("products/export/", ProductExportView.as_view(), name="products-export"),
     path("basket/", BasketView.as_view(), name="basket"),
     path("order/", OrderView.as_view(), name="order"),
 ] + router.urls
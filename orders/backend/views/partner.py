@@ -1,6 +1,8 @@
 import datetime
 from distutils.util import strtobool
 
+from backend.cache import bump_catalog_version
+from backend.catalog import refresh_shops
 from backend.models import ConfirmEmailToken, Delivery, Order, Shop, User
 from backend.permissions import IsShop
 from backend.serializers import (
@@ -206,9 +208,11 @@ class PartnerViewSet(viewsets.GenericViewSet):
                 )
 
             try:
-                Shop.objects.filter(user_id=request.user.id).update(
-                    state=strtobool(state)
-                )
+                shops = Shop.objects.filter(user_id=request.user.id)
+                shops.update(state=strtobool(state))
+                shop_ids = list(shops.values_list("id", flat=True))
+                refresh_shops(shop_ids)
+                bump_catalog_version(shop_ids)
                 return JsonResponse({"Status": True})
             except ValueError as error:
                 return JsonResponse(
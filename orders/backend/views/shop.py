@@ -1,21 +1,33 @@
-from backend.models import Category, Delivery, Order, OrderItem, ProductInfo, Shop
+from backend.basket import add_items, reserve_stock, update_items
+from backend.cache import CatalogCacheMixin, get_orders_etag, not_modified
+from backend.filters import filter_offers, filter_parameters, get_facets, id_param
+from backend.models import Category, Order, ProductInfo, Shop
+from backend.pagination import ProductInfoPagination
+from backend.renderers import CSVRenderer, NDJSONRenderer
+from backend.search import search_offers
 from backend.serializers import (
+    ORDER_ITEMS_PREFETCH,
+    BasketItemSerializer,
+    BasketItemUpdateSerializer,
     CategorySerializer,
-    OrderItemSerializer,
     OrderSerializer,
     ProductInfoSerializer,
-    ShopOrderSerializer,
+    ProductInfoValuesSerializer,
     ShopSerializer,
     StatusFalseSerializer,
     StatusTrueSerializer,
+    field_columns,
+    group_order_items,
+    select_fields,
 )
 from backend.tasks import send_email_task
 from django.conf import settings
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 from django.db.models import F, Q, Sum
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from drf_spectacular.utils import extend_schema, inline_serializer
 from rest_framework import fields, status
+from rest_framework.exceptions import ValidationError
 from rest_framework.generics import ListAPIView
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
@@ -25,7 +37,7 @@ from silk.profiling.profiler import silk_profile
 from orders.schema import BASKET_RESPONSE, MY_ORDERS_RESPONSE
 
 
-class CategoryView(ListAPIView):
+class CategoryView(CatalogCacheMixin, ListAPIView):
     """
     Category list
     """
@@ -34,7 +46,7 @@ class CategoryView(ListAPIView):
     serializer_class = CategorySerializer
 
 
-class ShopView(ListAPIView):
+class ShopView(CatalogCacheMixin, ListAPIView):
     """
     Shop list
     """
@@ -43,37 +55,100 @@ class ShopView(ListAPIView):
     serializer_class = ShopSerializer
 
 
-class ProductInfoView(APIView):
+class ProductInfoView(CatalogCacheMixin, ListAPIView):
     """
     Product filter
     """
 
-    queryset = ProductInfo.objects.none()
-    serializer_class = ProductInfoSerializer
+    serializer_class = ProductInfoValuesSerializer
+    pagination_class = ProductInfoPagination
 
-    @silk_profile(name="View Product Info")
-    def get(self, request, *args, **kwargs):
-        query = Q(shop__state=True)
-        shop_id = request.query_params.get("shop_id")
-        category_id = request.query_params.get("category_id")
+    def get_catalog_shop_id(self):
+        return id_param(self.request.query_params, "shop_id")
+
+    def get_queryset(self):
+        query = Q(shop_state=True, is_active=True)
+        shop_id = id_param(self.request.query_params, "shop_id")
+        category_id = id_param(self.request.query_params, "category_id")
+        product_id = id_param(self.request.query_params, "product_id")
+        search = self.request.query_params.get("search", "").strip()
 
         if shop_id:
             query = query & Q(shop_id=shop_id)
 
         if category_id:
-            query = query & Q(product__category_id=category_id)
-
-        # фильтруем и отбрасываем дубликаты
-        queryset = (
-            ProductInfo.objects.filter(query)
-            .select_related("shop", "product__category")
-            .prefetch_related("product_parameters__parameter")
-            .distinct()
+            query = query & Q(category_id=category_id)
+
+        # предложения одного продукта в разных магазинах
+        if product_id:
+            query = query & Q(product_id=product_id)
+
+        # только колонки модели чтения, без соединений и distinct:
+        # страница курсора читается по индексу без сортировки всей выборки
+        queryset = ProductInfo.objects.filter(query)
+        queryset = filter_offers(queryset, self.request.query_params)
+        queryset = filter_parameters(queryset, self.request.query_params).values(
+            *field_columns(self.get_fields())
         )
+        if search:
+            queryset = search_offers(queryset, search)
+        return queryset
 
-        serializer = ProductInfoSerializer(queryset, many=True)
+    def get_fields(self):
+        """
+        Response fields tree of the fields and expand query parameters
+        """
 
-        return Response(serializer.data)
+        params = {}
+        for param in ("fields", "expand"):
+            value = self.request.query_params.get(param)
+            if value is not None:
+                params[param] = [
+                    item.strip() for item in value.split(",") if item.strip()
+                ]
+        return select_fields(**params)
+
+    def get_serializer_context(self):
+        return {**super().get_serializer_context(), "fields": self.get_fields()}
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        # счётчики по всей отфильтрованной выборке, а не по странице
+        if self.request.query_params.get("facets", "").lower() in ("1", "true"):
+            response.data["facets"] = get_facets(self.get_queryset())
+        return response
+
+    @silk_profile(name="View Product Info")
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+
+class ProductExportView(ProductInfoView):
+    """
+    Streaming export of the catalog as NDJSON or CSV
+    """
+
+    renderer_classes = [NDJSONRenderer, CSVRenderer]
+    pagination_class = None
+
+    @extend_schema(responses={(200, "application/x-ndjson"): ProductInfoSerializer})
+    def get(self, request, *args, **kwargs):
+        # строки читаются серверным курсором порциями, ответ отдаётся
+        # по мере чтения, поэтому память не зависит от размера каталога
+        rows = (
+            self.get_queryset()
+            .order_by("id")
+            .iterator(chunk_size=settings.PRODUCTS_EXPORT_CHUNK_SIZE)
+        )
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            renderer.stream(self.get_fields(), rows),
+            content_type=f"{renderer.media_type}; charset={renderer.charset}",
+        )
+        response["Content-Disposition"] = (
+            f'attachment; filename="catalog.{renderer.format}"'
+        )
+        return response
 
 
 class BasketView(APIView):
@@ -91,13 +166,14 @@ class BasketView(APIView):
         GET Basket
         """
 
+        basket = Order.objects.filter(user_id=request.user.id, state="basket")
+        etag = get_orders_etag(request, basket)
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
+
         basket = (
-            Order.objects.filter(user_id=request.user.id, state="basket")
-            .prefetch_related(
-                "ordered_items__product_info__shop",
-                "ordered_items__product_info__product__category",
-                "ordered_items__product_info__product_parameters__parameter",
-            )
+            basket.prefetch_related(*ORDER_ITEMS_PREFETCH)
             .annotate(
                 total_sum=Sum(
                     F("ordered_items__quantity")
@@ -108,12 +184,12 @@ class BasketView(APIView):
         )
 
         serializer = OrderSerializer(basket, many=True)
-        return Response(serializer.data)
+        return Response(serializer.data, headers={"ETag": etag})
 
     @extend_schema(
         request=inline_serializer(
             "BasketAddRequestSerializer",
-            {"items": fields.ListField(child=OrderItemSerializer())},
+            {"items": fields.ListField(child=BasketItemSerializer())},
         ),
         responses={
             200: inline_serializer(
@@ -121,6 +197,7 @@ class BasketView(APIView):
                 {
                     "Status": fields.BooleanField(),
                     "Создано объектов": fields.IntegerField(),
+                    "Обновлено объектов": fields.IntegerField(),
                 },
             ),
             400: StatusFalseSerializer,
@@ -128,7 +205,8 @@ class BasketView(APIView):
     )
     def post(self, request, *args, **kwargs):
         """
-        Add products in Basket
+        Add products in Basket, quantities of products
+        already in the basket are summed up
         """
 
         items_list = request.data.get("items")
@@ -138,43 +216,42 @@ class BasketView(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
+        serializer = BasketItemSerializer(data=items_list, many=True)
+        if not serializer.is_valid():
+            return JsonResponse(
+                {"Status": False, "Errors": serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
         basket, _ = Order.objects.get_or_create(user_id=request.user.id, state="basket")
-        objects_created = 0
-        for order_item in items_list:
-            order_item.update({"order": basket.id})
-            serializer = OrderItemSerializer(data=order_item)
-            if serializer.is_valid():
-                try:
-                    serializer.save()
-                except IntegrityError as error:
-                    return JsonResponse(
-                        {"Status": False, "Errors": str(error)},
-                        status=status.HTTP_400_BAD_REQUEST,
-                    )
-                else:
-                    objects_created += 1
-            else:
-                return JsonResponse(
-                    {"Status": False, "Errors": serializer.errors},
-                    status=status.HTTP_400_BAD_REQUEST,
-                )
+        try:
+            objects_created, objects_updated = add_items(
+                basket, serializer.validated_data
+            )
+        except ValidationError as error:
+            return JsonResponse(
+                {"Status": False, "Errors": error.detail},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        except IntegrityError as error:
+            # позицию одновременно добавил параллельный запрос
+            return JsonResponse(
+                {"Status": False, "Errors": str(error)},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
 
-        return JsonResponse({"Status": True, "Создано объектов": objects_created})
+        return JsonResponse(
+            {
+                "Status": True,
+                "Создано объектов": objects_created,
+                "Обновлено объектов": objects_updated,
+            }
+        )
 
     @extend_schema(
         request=inline_serializer(
             "BasketUpdateRequestSerializer",
-            {
-                "items": fields.ListField(
-                    child=inline_serializer(
-                        "BasketItemUpdateRequestSerializer",
-                        {
-                            "id": fields.IntegerField(),
-                            "quantity": fields.IntegerField(),
-                        },
-                    )
-                )
-            },
+            {"items": fields.ListField(child=BasketItemUpdateSerializer())},
         ),
         responses={
             200: inline_serializer(
@@ -183,6 +260,13 @@ class BasketView(APIView):
                     "Status": fields.BooleanField(),
                     "Обновлено объектов": fields.IntegerField(),
                     "Удалено объектов": fields.IntegerField(),
+                    "Обновлённые позиции": fields.ListField(
+                        child=fields.IntegerField()
+                    ),
+                    "Удалённые позиции": fields.ListField(child=fields.IntegerField()),
+                    "Не найденные позиции": fields.ListField(
+                        child=fields.IntegerField()
+                    ),
                 },
             ),
             400: StatusFalseSerializer,
@@ -200,6 +284,13 @@ class BasketView(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
+        serializer = BasketItemUpdateSerializer(data=items_list, many=True)
+        if not serializer.is_valid():
+            return JsonResponse(
+                {"Status": False, "Errors": serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
         try:
             basket = Order.objects.get(user_id=request.user.id, state="basket")
         except Order.DoesNotExist:
@@ -208,36 +299,34 @@ class BasketView(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        objects_updated, deleted_count = 0, 0
-        query = Q()
-        has_objects_to_delete = False
-
-        for order_item in items_list:
-            item_id, qty = order_item.get("id"), order_item.get("quantity")
-
-            if type(item_id) == int and type(qty) == int:
-                if qty == 0:
-                    query = query | Q(order_id=basket.id, id=item_id)
-                    has_objects_to_delete = True
-                else:
-                    objects_updated += OrderItem.objects.filter(
-                        order_id=basket.id, id=item_id
-                    ).update(quantity=qty)
-
-        if has_objects_to_delete:
-            deleted_count, _ = OrderItem.objects.filter(query).delete()
+        try:
+            updated, deleted, not_found = update_items(
+                basket, serializer.validated_data
+            )
+        except ValidationError as error:
+            return JsonResponse(
+                {"Status": False, "Errors": error.detail},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
 
-        if objects_updated or deleted_count:
+        if updated or deleted:
             return JsonResponse(
                 {
                     "Status": True,
-                    "Обновлено объектов": objects_updated,
-                    "Удалено объектов": deleted_count,
+                    "Обновлено объектов": len(updated),
+                    "Удалено объектов": len(deleted),
+                    "Обновлённые позиции": updated,
+                    "Удалённые позиции": deleted,
+                    "Не найденные позиции": not_found,
                 }
             )
         else:
             return JsonResponse(
-                {"Status": False, "Errors": "Нет таких позиций в корзине"},
+                {
+                    "Status": False,
+                    "Errors": "Нет таких позиций в корзине",
+                    "Не найденные позиции": not_found,
+                },
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
@@ -257,14 +346,14 @@ class OrderView(APIView):
         GET my orders
         """
 
+        order = Order.objects.filter(user_id=request.user.id).exclude(state="basket")
+        etag = get_orders_etag(request, order)
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
+
         order = (
-            Order.objects.filter(user_id=request.user.id)
-            .exclude(state="basket")
-            .prefetch_related(
-                "ordered_items__product_info__shop",
-                "ordered_items__product_info__product__category",
-                "ordered_items__product_info__product_parameters__parameter",
-            )
+            order.prefetch_related(*ORDER_ITEMS_PREFETCH)
             .select_related("address")
             .annotate(
                 total_sum=Sum(
@@ -276,7 +365,7 @@ class OrderView(APIView):
         )
 
         serializer = OrderSerializer(order, many=True)
-        return Response(serializer.data)
+        return Response(serializer.data, headers={"ETag": etag})
 
     @extend_schema(
         request=inline_serializer(
@@ -287,6 +376,7 @@ class OrderView(APIView):
     def post(self, request, *args, **kwargs):
         """
         POST order from basket
+        reserve stock of the ordered products
         send new order mail to admin
         send order status to user
         """
@@ -299,38 +389,14 @@ class OrderView(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        invalid_deliveries = []
-        shops = (
-            Shop.objects.filter(product_infos__ordered_items__order=basket.id)
-            .prefetch_related(
-                "product_infos__product__category",
-                "product_infos__product_parameters__parameter",
-            )
-            .annotate(
-                shop_sum=Sum(
-                    F("product_infos__ordered_items__quantity")
-                    * F("product_infos__price")
-                )
-            )
-            .distinct()
-        )
-        for shop in shops:
-            shop_data = ShopOrderSerializer(shop, order_id=basket.id).data
-            shop_deliveries = Delivery.objects.filter(shop=shop)
-            if not shop_deliveries:
-                invalid_deliveries.append(
-                    f"{shop_data['name']}: " f"стоимость доставки недоступна."
-                )
-            else:
-                shop_delivery = (
-                    shop_deliveries.filter(min_sum__lte=shop_data["shop_sum"])
-                    .order_by("-min_sum")
-                    .first()
-                )
-                if shop_delivery is None:
-                    invalid_deliveries.append(
-                        f"{shop_data['name']}: сумма заказа меньше минимальной"
-                    )
+        items = basket.ordered_items.select_related(
+            "product_info__shop"
+        ).prefetch_related("product_info__shop__delivery")
+        invalid_deliveries = [
+            f"{group['shop'].name}: {group['error']}"
+            for group in group_order_items(items)
+            if group["error"] is not None
+        ]
         if invalid_deliveries:
             return JsonResponse(
                 {"Status": False, "Errors": invalid_deliveries},
@@ -350,9 +416,16 @@ class OrderView(APIView):
             )
 
         try:
-            basket.address_id = address_id
-            basket.state = "new"
-            basket.save()
+            with transaction.atomic():
+                reserve_stock(basket)
+                basket.address_id = address_id
+                basket.state = "new"
+                basket.save()
+        except ValidationError as error:
+            return JsonResponse(
+                {"Status": False, "Errors": error.detail},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
         except IntegrityError:
             return JsonResponse(
                 {"Status": False, "Errors": "Адрес не найден"},
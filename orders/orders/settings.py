@@ -17,7 +17,23 @@ import environ
 
 env = environ.Env(
     # set casting, default value
-    DEBUG=(bool, False)
+    DEBUG=(bool, False),
+    IMPORT_BATCH_SIZE=(int, 1000),
+    IMPORT_INCREMENTAL=(bool, True),
+    IMPORT_PARTITIONED=(bool, False),
+    IMPORT_CHUNK_SIZE=(int, 10000),
+    IMPORT_LOCK_TIMEOUT=(int, 3600),
+    IMPORT_LOCK_RETRY_DELAY=(int, 60),
+    IMPORT_USE_COPY=(bool, True),
+    PRICE_LIST_FETCH_TIMEOUT=(float, 30),
+    PRICE_LIST_FETCH_RETRIES=(int, 3),
+    PRICE_LIST_FETCH_WORKERS=(int, 10),
+    PRICE_LIST_FETCH_HOST_CONNECTIONS=(int, 4),
+    PRODUCTS_PAGE_SIZE=(int, 50),
+    PRODUCTS_MAX_PAGE_SIZE=(int, 500),
+    PRODUCTS_EXPORT_CHUNK_SIZE=(int, 2000),
+    CATALOG_CACHE_TIMEOUT=(int, 3600),
+    SEARCH_CONFIG=(str, "russian"),
 )
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
@@ -49,6 +65,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "rest_framework",
     "rest_framework.authtoken",
     "django_rest_passwordreset",
@@ -162,13 +179,43 @@ REST_FRAMEWORK = {
     "DEFAULT_THROTTLE_RATES": {"anon": "100/day", "user": "1000/day"},
 }
 
+# Product catalog pagination
+PRODUCTS_PAGE_SIZE = env("PRODUCTS_PAGE_SIZE")
+PRODUCTS_MAX_PAGE_SIZE = env("PRODUCTS_MAX_PAGE_SIZE")
+# rows fetched at once by the streaming catalog export
+PRODUCTS_EXPORT_CHUNK_SIZE = env("PRODUCTS_EXPORT_CHUNK_SIZE")
+# PostgreSQL text search configuration of the product search
+SEARCH_CONFIG = env("SEARCH_CONFIG")
+
 # Celery settings
 REDIS_HOST = env("REDIS_HOST")
 CELERY_BROKER_URL = f"redis://{REDIS_HOST}:6379"
 CELERY_RESULT_BACKEND = f"redis://{REDIS_HOST}:6379"
 
+CACHES = {"default": env.cache("CACHE_URL", default=f"redis://{REDIS_HOST}:6379/1")}
+# cached catalog responses are invalidated by the catalog version,
+# the timeout only limits the lifetime of unused entries
+CATALOG_CACHE_TIMEOUT = env("CATALOG_CACHE_TIMEOUT")
+
 ADMIN_EMAIL = env("ADMIN_EMAIL")
 
+# Price list import settings
+IMPORT_BATCH_SIZE = env("IMPORT_BATCH_SIZE")
+# incremental import rewrites only changed offers, full import rewrites all of them
+IMPORT_INCREMENTAL = env("IMPORT_INCREMENTAL")
+# partitioned import splits goods into chunks processed by parallel subtasks
+IMPORT_PARTITIONED = env("IMPORT_PARTITIONED")
+IMPORT_CHUNK_SIZE = env("IMPORT_CHUNK_SIZE")
+# seconds after which a lock of an unfinished shop import is considered stale
+IMPORT_LOCK_TIMEOUT = env("IMPORT_LOCK_TIMEOUT")
+IMPORT_LOCK_RETRY_DELAY = env("IMPORT_LOCK_RETRY_DELAY")
+# load staged offers with COPY and merge them with SQL on PostgreSQL
+IMPORT_USE_COPY = env("IMPORT_USE_COPY")
+PRICE_LIST_FETCH_TIMEOUT = env("PRICE_LIST_FETCH_TIMEOUT")
+PRICE_LIST_FETCH_RETRIES = env("PRICE_LIST_FETCH_RETRIES")
+PRICE_LIST_FETCH_WORKERS = env("PRICE_LIST_FETCH_WORKERS")
+PRICE_LIST_FETCH_HOST_CONNECTIONS = env("PRICE_LIST_FETCH_HOST_CONNECTIONS")
+
 SPECTACULAR_SETTINGS = {
     "TITLE": "Orders API",
     "DESCRIPTION": "Описание API сервиса заказа товаров",